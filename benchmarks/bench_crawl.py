@@ -0,0 +1,157 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import standin
+from peewee import PostgresqlDatabase
+from models import Region, Attraction, Town, Page, Frontier
+import slovenia_info_scra as scra
+import crawler
+import frontier
+import metrics
+import recrawl
+import store
+
+
+# crawl speed on a local stand-in site (standin.py), no network needed
+# runs the serial scraper (selectRegion/addTowns) and/or crawler.py on the same site and reports pages/s, CPU time
+# per page (including parsing processes) and DB writes/s
+# rows are written to a separate DB (--db, same user as in models.py), its tables are emptied before every run
+# run: python benchmarks/bench_crawl.py [--mode serial|crawler|both] [--latency 0.02] [--errors 0.01] ...
+
+models = [Region, Attraction, Town, Page, Frontier]
+
+
+
+def useDatabase(name):
+
+    # point all models to the benchmark DB and start with empty tables
+
+    database = PostgresqlDatabase(name, user='adminslo', password='slo', host='localhost')
+    for model in models:
+        model._meta.database = database
+
+    database.drop_tables(models, safe=True, cascade=True)
+    database.create_tables(models)
+
+    return database
+
+
+
+def resetState(database):
+
+    # empty tables and forget everything the modules loaded from them
+
+    for model in reversed(models):
+        model.delete().execute()
+
+    store.regionIds = None
+    recrawl.known = None
+    frontier.seen = None
+    metrics.reset()
+
+    return
+
+
+
+def cpuTime():
+
+    # user + system time of this process and of finished child processes (parsers of crawler.py)
+
+    times = os.times()
+
+    return times[0] + times[1] + times[2] + times[3]
+
+
+
+def runSerial(site):
+
+    scra.baseUrl = site.baseUrl
+    scra.regions = site.regionUrls
+    scra.townsUrl = site.townsUrl
+    scra.delay = 0
+
+    context = scra.CrawlContext()
+    scra.selectRegion(context)
+    scra.addTowns(context)
+
+    return
+
+
+
+def runCrawler(site, concurrency):
+
+    # no politeness needed for a local server
+
+    engine = crawler.Crawler(concurrency=concurrency, rate=10000.0, burst=concurrency, siteUrl=site.baseUrl)
+    engine.run([url + str(scra.lng) for url in site.regionUrls], site.townsUrl + str(scra.lng), resume=False)
+
+    return
+
+
+
+def measure(name, run, database):
+
+    resetState(database)
+    start = time.time()
+    startCpu = cpuTime()
+    run()
+    elapsed = time.time() - start
+    cpu = cpuTime() - startCpu
+
+    pages = metrics.total('pages_total')
+    rows = metrics.total('db_rows_total')
+
+    return (name, pages, elapsed, cpu, rows, metrics.total('retries_total'), metrics.total('errors_total'))
+
+
+
+def report(results):
+
+    print('\nrun        pages   time (s)   pages/s   CPU ms/page   DB writes/s   retries   errors')
+    for name, pages, elapsed, cpu, rows, retries, errors in results:
+        print('%-8s %7d %10.2f %9.1f %13.2f %13.1f %9d %8d' % (name, pages, elapsed, pages / max(elapsed, 0.001),
+              1000 * cpu / max(pages, 1), rows / max(elapsed, 0.001), retries, errors))
+
+    return
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Crawl benchmark on a local stand-in site')
+    parser.add_argument('--mode', choices=['serial', 'crawler', 'both'], default='both')
+    parser.add_argument('--db', default='slovenia_bench', help='DB for benchmark rows (gets emptied!)')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every answer')
+    parser.add_argument('--jitter', type=float, default=0.01, help='random seconds added on top of latency')
+    parser.add_argument('--errors', type=float, default=0.0, help='share of answers that fail with 503')
+    parser.add_argument('--regions', type=int, default=3)
+    parser.add_argument('--groups', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=3, help='pages per group')
+    parser.add_argument('--items', type=int, default=20, help='items per page')
+    parser.add_argument('--towns', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    server = standin.start(args.latency, args.jitter, args.errors, regions=args.regions, groups=args.groups,
+                           pagesPerGroup=args.pages, itemsPerPage=args.items, towns=args.towns)
+    site = server.site
+    print('Stand-in site at', site.baseUrl, 'with', len(site.pages), 'pages,', site.items, 'attractions and towns')
+
+    database = useDatabase(args.db)
+    results = []
+    if args.mode in ('serial', 'both'):
+        results.append(measure('serial', lambda: runSerial(site), database))
+    if args.mode in ('crawler', 'both'):
+        results.append(measure('crawler', lambda: runCrawler(site, args.concurrency), database))
+
+    report(results)
+    server.shutdown()
+
+    return
+
+
+
+main()
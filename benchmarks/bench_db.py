@@ -0,0 +1,171 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from peewee import PostgresqlDatabase, SqliteDatabase
+from models import Region, Attraction, Town, Page, Frontier, CrawlWorker
+import migrations
+
+
+# speed of the lookups the scraper and search do all the time, on a big DB (--rows attractions and towns), before
+# and after migrations.py: DB is first set up like an old one (tables without any index except primary keys), then
+# migrated, same queries are timed again
+# rows are written to a separate DB (--db, same user as in models.py), its tables are dropped before every run
+# run: python benchmarks/bench_db.py [--rows 100000] [--queries 200] [--sqlite bench.db]
+
+models = [Region, Attraction, Town, Page, Frontier, CrawlWorker]
+regionNames = ['Gorenjska', 'Goriška', 'Obalno - kraška', 'Osrednjeslovenska', 'Podravska', 'Notranjsko - kraška',
+               'Jugovzhodna Slovenija', 'Koroška', 'Savinjska', 'Pomurska', 'Spodnjeposavska', 'Zasavska']
+
+
+
+def useDatabase(name, sqlite=None):
+
+    # point all models to the benchmark DB and create tables like an old DB has them: no indexes
+    # sqlite = path of a sqlite file to use instead of Postgres (no server needed, numbers are not the same)
+
+    if sqlite:
+        database = SqliteDatabase(sqlite)
+    else:
+        database = PostgresqlDatabase(name, user='adminslo', password='slo', host='localhost')
+    for model in models:
+        model._meta.database = database
+
+    database.drop_tables(models, safe=True, cascade=not sqlite)
+    database.create_tables(models)
+    for model in models:
+        table = model._meta.db_table
+        for index in database.get_indexes(table):
+            if index.columns != ['id']:
+                database.execute_sql('DROP INDEX %s' % database.compiler().quote(index.name))
+
+    return database
+
+
+
+def itemRow(kind, i, region):
+
+    return {
+        'name': '%s %d' % (kind, i), 'link': '/si/%s/%s-%d.htm' % (kind, kind, i), 'webpage': '', 'tags': '',
+        'type': kind, 'description': 'Opis %d' % i, 'picture': '', 'regionName': region.name, 'region': region.id,
+        'destination': '', 'place': '', 'gpsX': 46.0 + random.random(), 'gpsY': 14.0 + random.random(),
+        'topResult': i % 100 == 0,
+    }
+
+
+
+def fill(database, rows):
+
+    # regions, 'rows' attractions and towns, frontier with an entry for each of them (most of them done)
+
+    regions = [Region.create(name=name, link='/si/Regije/%s.htm' % name, description='', picture='')
+               for name in regionNames]
+
+    start = time.time()
+    batch = 1000
+    for first in range(0, rows, batch):
+        with database.atomic():
+            attractions = []
+            towns = []
+            entries = []
+            for i in range(first, min(first + batch, rows)):
+                region = regions[i % len(regions)]
+                attraction = itemRow('Znamenitost', i, region)
+                attraction.update({'address': '', 'phone': ''})
+                attractions.append(attraction)
+                town = itemRow('Kraj', i, region)
+                town.update({'population': i, 'altitude': '', 'position': '', 'tempSummer': '', 'tempWinter': '',
+                             'sunnyDays': 0, 'rainyDays': 0})
+                towns.append(town)
+                entries.append({'url': attraction['link'], 'key': attraction['link'], 'kind': 'attraction',
+                                'status': 'pending' if i % 50 == 0 else 'done'})
+            Attraction.insert_many(attractions).execute()
+            Town.insert_many(towns).execute()
+            Frontier.insert_many(entries).execute()
+
+    print('Filled DB with', rows, 'attractions,', rows, 'towns and', rows, 'frontier entries in',
+          round(time.time() - start, 1), 's')
+
+    return
+
+
+
+def lookups():
+
+    # name -> function(i) that runs one query for item i (same queries as in scraper, recrawl, search and frontier)
+
+    return [
+        ('attraction by link', lambda i: Attraction.get(Attraction.link == '/si/Znamenitost/Znamenitost-%d.htm' % i)),
+        ('attraction by name, region', lambda i: Attraction.get(Attraction.name == 'Znamenitost %d' % i,
+                                                                Attraction.regionName == regionNames[i % len(regionNames)])),
+        ('town by name, region', lambda i: Town.get(Town.name == 'Kraj %d' % i,
+                                                    Town.regionName == regionNames[i % len(regionNames)])),
+        ('town by link', lambda i: Town.get(Town.link == '/si/Kraj/Kraj-%d.htm' % i)),
+        ('region by name', lambda i: Region.get(Region.name == regionNames[i % len(regionNames)])),
+        ('item by id (getFromDB)', lambda i: Attraction.get(Attraction.id == i + 1)),
+        ('pending frontier entries', lambda i: Frontier.select().where(Frontier.status == 'pending',
+                                                                     Frontier.kind == 'attraction').count()),
+    ]
+
+
+
+def measure(rows, queries):
+
+    # ms per query for every lookup
+
+    results = []
+    picks = [random.randrange(rows) for i in range(queries)]
+    for name, lookup in lookups():
+        start = time.time()
+        for i in picks:
+            lookup(i)
+        results.append((name, 1000 * (time.time() - start) / queries))
+
+    return results
+
+
+
+def report(before, after):
+
+    print('\nquery                           before (ms)   after (ms)   speedup')
+    for (name, slow), (same, fast) in zip(before, after):
+        print('%-30s %12.3f %12.3f %9.1fx' % (name, slow, fast, slow / max(fast, 0.001)))
+
+    return
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Lookup speed before and after migrations on a big DB')
+    parser.add_argument('--db', default='slovenia_bench', help='DB for benchmark rows (gets dropped!)')
+    parser.add_argument('--rows', type=int, default=100000, help='attractions (and towns) in DB')
+    parser.add_argument('--queries', type=int, default=200, help='queries per lookup')
+    parser.add_argument('--sqlite', help='sqlite file to use instead of Postgres (gets dropped!)')
+    args = parser.parse_args()
+
+    random.seed(1)
+    database = useDatabase(args.db, args.sqlite)
+    fill(database, args.rows)
+
+    before = measure(args.rows, args.queries)
+
+    start = time.time()
+    migrations.run(database)
+    print('Migrations took', round(time.time() - start, 1), 's')
+    # second run has nothing to do
+    again = migrations.run(database)
+    if len(again) > 0:
+        print('WARNING: second run of migrations changed', again)
+
+    after = measure(args.rows, args.queries)
+    report(before, after)
+
+    return
+
+
+
+main()
@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+from lxml import html, etree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import extract
+
+
+# parse speed of attraction and town pages (pages/sec), old way vs. extract.py, on saved pages in 'fixtures', and
+# speed of fixLinks alone (on the description, as the scraper calls it)
+# (fixtures are rebuilt from the XPaths the scraper uses, as the original site got redesigned)
+# run: python benchmarks/bench_parse.py [number of rounds]
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+
+def loadFixture(name):
+
+    # raw page, as we'd get it from the server
+
+    with open(os.path.join(fixtures, name), 'rb') as fp:
+        return fp.read()
+
+
+
+def legacyFixLinks(content):
+
+    # fixLinks as it was when this benchmark was written (walks the whole document)
+
+    for node in content.xpath('//*[@src]'):
+        node.set('src', extract.join(node.get('src')))
+
+    for node in content.xpath('//*[@href]'):
+        node.set('href', extract.join(node.get('href')))
+
+    return content
+
+
+
+def legacyMapRow(tree, row):
+
+    # region/destination/place: link first, then plain text
+
+    values = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row ' + row + '"]/a/text()')
+    if len(values) < 1:
+        values = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row ' + row + '"]/text()')
+
+    return values
+
+
+
+def legacyCommon(tree, elTree):
+
+    # fields that are the same for attractions and towns, extracted the old way: two parsed trees, XPath strings
+
+    tree.xpath('// *[ @ id = "tdMainCenter"] / div[3] / div[1] / div[4] / h1/text()')
+    tree.xpath('//*[@id="tdMainCenter"]/div[1]//a/text()')
+    description = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]')
+    childDiv = description[0].find('div')
+    if childDiv is not None:
+        description[0].remove(childDiv)
+    etree.tostring(legacyFixLinks(description[0]))
+    tree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/a/img/@src')
+    for row in ('region', 'destination', 'place'):
+        legacyMapRow(tree, row)
+    tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row gps"]/a/text()')
+
+
+
+def legacyAttraction(content):
+
+    tree = html.fromstring(content)
+    elTree = etree.HTML(content.decode('utf-8'))
+    props = '//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[1]/div[1]/'
+    tree.xpath(props + 'div[@class="prop propLocation"]/div[2]/text()')
+    tree.xpath(props + 'div[@class="prop propPhone"]/div[2]/text()')
+    elTree.xpath(props + 'div[2]/div[2]')
+    tree.xpath(props + 'div[@class="prop propRow propWWW"]/a/text()')
+    legacyCommon(tree, elTree)
+
+
+
+def legacyTown(content):
+
+    tree = html.fromstring(content)
+    elTree = etree.HTML(content.decode('utf-8'))
+    townData = '//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[@class="mainTownData"]/'
+    tree.xpath('//div[@class="ticItems"]/div[@class="item"]/div[@class="w"]/a/@href')
+    tree.xpath(townData + 'div[@class="item pop"]/div/text()')
+    tree.xpath(townData + 'div[@class="item alt"]/div/text()')
+    tree.xpath(townData + 'div[@class="item pos"]/text()')
+    tree.xpath(townData + 'div[@class="item tmpr"]//span[@class="N3"]/text()')
+    tree.xpath(townData + 'div[@class="item sun"]//span[@class="N3"]/text()')
+    legacyCommon(tree, elTree)
+
+
+
+def pagesPerSecond(parse, content, rounds):
+
+    start = time.perf_counter()
+    for i in range(rounds):
+        parse(content)
+
+    return rounds / (time.perf_counter() - start)
+
+
+
+def description(content):
+
+    # description of a parsed page, as it's given to fixLinks
+
+    return html.fromstring(content).xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]')[0]
+
+
+
+def runFixLinks(cases, rounds):
+
+    # old and new fixLinks have to give the same description; links are already absolute after the first call, so
+    # following calls measure the walk over the nodes and joining
+
+    print('\nfixLinks    before (calls/s)   after (calls/s)   speedup')
+    for name, content, before, after in cases:
+        old = etree.tostring(legacyFixLinks(description(content)))
+        new = etree.tostring(extract.fixLinks(description(content)))
+        assert old == new, 'fixLinks changed the description of ' + name
+
+        rateBefore = pagesPerSecond(legacyFixLinks, description(content), rounds)
+        rateAfter = pagesPerSecond(extract.fixLinks, description(content), rounds)
+        print('%-11s %16.1f %17.1f %8.2fx' % (name, rateBefore, rateAfter, rateAfter / rateBefore))
+
+    return
+
+
+
+def run(rounds=500):
+
+    cases = [
+        ('attraction', loadFixture('attraction.html'), legacyAttraction, extract.attractionExtract),
+        ('town', loadFixture('town.html'), legacyTown, extract.townExtract),
+    ]
+
+    print('page        before (pages/s)   after (pages/s)   speedup')
+    for name, content, before, after in cases:
+        # warm up
+        before(content)
+        after(content)
+
+        rateBefore = pagesPerSecond(before, content, rounds)
+        rateAfter = pagesPerSecond(after, content, rounds)
+        print('%-11s %16.1f %17.1f %8.2fx' % (name, rateBefore, rateAfter, rateAfter / rateBefore))
+
+    runFixLinks(cases, rounds * 10)
+
+    return
+
+
+
+run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
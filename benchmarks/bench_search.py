@@ -0,0 +1,74 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from whoosh.index import open_dir
+from models import connectDB
+import search
+import searchbackend
+
+
+# same queries through both search backends (searchbackend.py): Whoosh index and full-text search in PostgreSQL
+# reports ms per query (whole analyzeQuery(), with corrections and filters) and how many of the hits are the same
+# needs a built index (search.init()) and a DB prepared with "python searchbackend.py", both from the same data
+# run: python benchmarks/bench_search.py [--index index] [--repeat 5]
+
+queries = [
+    'kje je bled', 'ljubljana', 'ljubljanski grad', 'grat', 'ljubljna', 'povej mi kaj o bledu',
+    'seznam rek', 'seznam rek ob morju', 'reke pri ljubljani', 'gradovi na primorskem', 'arhitektura ljubljana',
+    'seznam arhitekture', 'znamenitosti v blizini', 'jezera na gorenjskem', 'seznam gradov v sloveniji',
+]
+
+
+
+def run(index, repeat):
+
+    # hits of every query (list of (typeID, id)) and ms per query
+
+    hits = []
+    start = time.time()
+    for i in range(repeat):
+        hits = []
+        for query in queries:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = search.analyzeQuery(index, query, 'ljubljana')
+            hits.append([(hit['typeID'], str(hit['id'])) for hit in results.values()])
+
+    return hits, 1000 * (time.time() - start) / (repeat * len(queries))
+
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Whoosh and PostgreSQL search backends on the same queries')
+    parser.add_argument('--index', default='index', help='Whoosh index dir')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of all queries')
+    args = parser.parse_args()
+
+    backends = [('whoosh', searchbackend.get(open_dir(args.index))),
+                ('postgres', searchbackend.PostgresBackend(connectDB()))]
+
+    results = [(name,) + run(backend, args.repeat) for name, backend in backends]
+
+    print('\nbackend      ms/query')
+    for name, hits, ms in results:
+        print('%-10s %10.1f' % (name, ms))
+
+    # same hits in both (first hit and all of them)
+    print('\nquery                              first hit   same hits')
+    whooshHits = results[0][1]
+    postgresHits = results[1][1]
+    for query, first, second in zip(queries, whooshHits, postgresHits):
+        sameFirst = len(first) > 0 and len(second) > 0 and first[0] == second[0]
+        same = len(set(first) & set(second))
+        print('%-34s %9s %6d / %d' % (query, 'yes' if sameFirst else 'no', same, max(len(first), len(second))))
+
+    return
+
+
+
+main()
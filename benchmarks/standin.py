@@ -0,0 +1,193 @@
+import os
+import random
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+# local stand-in for www.slovenia.info, for crawler benchmarks without network
+# the site has the same structure as the original one (as far as the scraper sees it): regions, their lists of
+# attractions with groups of items (group 1 = top results) and paginated groups, list of towns and pages of single
+# attractions and towns (made from the saved pages in 'fixtures'); top results are the same for all regions, so
+# the same attraction is linked from more lists
+# every answer can be delayed (latency + random jitter) and some of them can fail with 503 (errorRate)
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+regionNames = ['Gorenjska', 'Goriška', 'Obalno - kraška', 'Osrednjeslovenska', 'Podravska', 'Notranjsko - kraška',
+               'Jugovzhodna Slovenija', 'Koroška', 'Savinjska', 'Pomurska', 'Spodnjeposavska', 'Zasavska']
+
+pageTemplate = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"/><title>%(title)s</title></head>
+<body><table id="layout"><tr><td id="tdMainCenter">
+<div class="navPath"><a href="/si/">Domov</a></div>
+<div class="tools"></div>
+%(content)s
+</td></tr></table></body></html>
+'''
+
+
+
+def loadFixture(name):
+
+    with open(os.path.join(fixtures, name), 'rb') as fp:
+        return fp.read().decode('utf-8')
+
+
+
+class StandInSite(object):
+
+    # all pages of the site, built in advance: path (with query) -> body
+    # baseUrl = where the site is served (links to lists of attractions are absolute on the original site)
+
+    def __init__(self, baseUrl, regions=3, groups=3, pagesPerGroup=3, itemsPerPage=20, topResults=5, towns=60):
+        self.baseUrl = baseUrl
+        self.pages = {}
+        self.attractionTemplate = loadFixture('attraction.html')
+        self.townTemplate = loadFixture('town.html')
+
+        self.regionUrls = []
+        for r in range(regions):
+            self.addRegion(r, regionNames[r % len(regionNames)], groups, pagesPerGroup, itemsPerPage, topResults)
+
+        self.townsUrl = '/si/Mesta-in-kraji.htm?_ctg_kraji=0&lng='
+        townLinks = [self.addTown(n, regionNames[n % regions]) for n in range(towns)]
+        self.addList(self.townsUrl + '1', [townLinks[:topResults]], townLinks[topResults:], pagesPerGroup, itemsPerPage)
+        self.townsUrl = baseUrl + self.townsUrl
+
+        self.items = sum(1 for path in self.pages if path.startswith(('/si/Znamenitosti/', '/si/Kraji/')))
+
+
+    def addRegion(self, r, name, groups, pagesPerGroup, itemsPerPage, topResults):
+
+        # region page and its list of attractions; urls are without lng param, like in the scraper
+
+        regionPath = '/si/Regije/Regija-%d.htm?_ctg_regije=%d&lng=' % (r, r)
+        listPath = '/si/Regije/Regija-%d/Znamenitosti.htm?_ctg_regije=%d&lng=1' % (r, r)
+        self.regionUrls.append(self.baseUrl + regionPath)
+
+        content = ('<div class="content"><div class="head"><div></div><div class="title"><h1>%s</h1></div><div></div>'
+                   '<div class="links"><a href="#">1</a><a href="#">2</a><a href="#">3</a><a href="%s">Znamenitosti</a></div>'
+                   '</div><div class="body">%s</div></div>') % (name, self.baseUrl + listPath, self.description(name))
+        self.pages[regionPath + '1'] = pageTemplate % {'title': name, 'content': content}
+
+        top = [self.addAttraction('Top-%d' % i, 'Top %d' % i, regionNames[0]) for i in range(topResults)]
+        rest = [self.addAttraction('Znamenitost-%d-%d' % (r, i), 'Znamenitost %d %d' % (r, i), name)
+                for i in range((groups - 1) * pagesPerGroup * itemsPerPage)]
+        self.addList(listPath, [top], rest, pagesPerGroup, itemsPerPage)
+
+
+    def addList(self, listPath, firstGroups, links, pagesPerGroup, itemsPerPage):
+
+        # list page with groups (first groups are given, the rest of links are split to groups of pagesPerGroup
+        # pages) and one page for every other page of every group
+
+        groupPages = [[group] for group in firstGroups]
+        perGroup = pagesPerGroup * itemsPerPage
+        for start in range(0, len(links), perGroup):
+            groupLinks = links[start:start + perGroup]
+            groupPages.append([groupLinks[i:i + itemsPerPage] for i in range(0, len(groupLinks), itemsPerPage)])
+
+        for g, pages in enumerate(groupPages):
+            for p in range(len(pages)):
+                path = listPath if p == 0 else '%s&group=%d&page=%d' % (listPath, g, p)
+                self.pages[path] = self.listPage(listPath, groupPages, g, p)
+
+
+    def listPage(self, listPath, groupPages, shownGroup, shownPage):
+
+        # all groups, with page 'shownPage' of group 'shownGroup' and first pages of others
+
+        boxes = []
+        for g, pages in enumerate(groupPages):
+            links = pages[shownPage if g == shownGroup else 0]
+            items = ''.join('<div class="box2"><p><a href="#">Lokacija</a> <a href="%s">%s</a></p></div>' % (link, link)
+                            for link in links)
+            if g == 0:
+                items += ''.join('<div class="info"><a href="%s">Top</a></div>' % link for link in links)
+            paging = ''.join('<a href="%s">%d</a>' % (listPath if p == 0 else '%s&group=%d&page=%d' % (listPath, g, p), p + 1)
+                             for p in range(len(pages)))
+            boxes.append('<div id="resultsBox%d">%s<div class="subbox"><div class="paging"><div class="links">%s'
+                         '</div></div></div></div>' % (g, items, paging))
+
+        return pageTemplate % {'title': 'Seznam', 'content': '<div class="results">%s</div>' % ''.join(boxes)}
+
+
+    def description(self, name):
+        return ('<div class="description"><a href="/pictures/big.jpg"><img src="pictures/%s.jpg"/></a>'
+                '<p>Opis: <a href="/si/Opis.htm">%s</a></p></div>') % (name, name)
+
+
+    def addAttraction(self, slug, name, regionName):
+
+        path = '/si/Znamenitosti/%s.htm' % slug
+        page = self.attractionTemplate.replace('<h1>Blejsko jezero</h1>', '<h1>%s</h1>' % name)
+        self.pages[path] = page.replace('>Gorenjska</a>', '>%s</a>' % regionName)
+
+        return path
+
+
+    def addTown(self, n, regionName):
+
+        path = '/si/Kraji/Kraj-%d.htm' % n
+        page = self.townTemplate.replace('<h1>Kranj</h1>', '<h1>Kraj %d</h1>' % n)
+        self.pages[path] = page.replace('>Gorenjska</a>', '>%s</a>' % regionName)
+
+        return path
+
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        if server.latency or server.jitter:
+            time.sleep(server.latency + server.random.random() * server.jitter)
+
+        body = server.site.pages.get(self.path)
+        with server.lock:
+            server.requests += 1
+            failed = server.random.random() < server.errorRate
+
+        if failed:
+            self.send_error(503)
+        elif body is None:
+            self.send_error(404)
+        else:
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        return
+
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+
+def start(latency=0.0, jitter=0.0, errorRate=0.0, seed=1, **siteOptions):
+
+    # start server on a free local port (in a background thread); returns it, site is in server.site
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.latency = latency
+    server.jitter = jitter
+    server.errorRate = errorRate
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.site = StandInSite('http://127.0.0.1:%d' % server.server_address[1], **siteOptions)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
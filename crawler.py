@@ -0,0 +1,427 @@
+import asyncio
+import os
+import time
+import fetcher
+import extract
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urljoin, urlsplit
+import slovenia_info_scra as scra
+import store
+import recrawl
+import frontier
+import metrics
+
+
+# concurrent crawl engine for www.slovenia.info
+# it drives the same steps as the serial scraper (region -> list of attractions/towns -> single item), but keeps
+# many requests in flight: fetches run in a bounded pool of threads
+# attractions and towns go through three stages with bounded queues between them: fetch -> parse (lxml, in a pool
+# of processes, one per core) -> store (event loop thread, so peewee only ever sees one thread); a full queue stops
+# the stage before it, so fetched pages never pile up in memory when parsing or DB can't keep up
+# (regions and lists are only a few pages, they are parsed right after fetching)
+# politeness is kept with a token bucket per host instead of sleeping after every request
+# what's left to crawl is kept in a persistent frontier (frontier.py), a stopped crawl continues from there
+
+
+
+class TokenBucket(object):
+
+    # rate limiter for one host: on average 'rate' requests per second, at most 'burst' requests at once
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+    async def acquire(self):
+
+        # wait until there is a token available; waiters are served one by one, in order
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+
+class Stage(object):
+
+    # counters of one pipeline stage: items done and time spent on them (summed over all its workers)
+
+    def __init__(self, name):
+        self.name = name
+        self.done = 0
+        self.busy = 0.0
+
+
+    def add(self, start):
+        self.done += 1
+        self.busy += time.monotonic() - start
+
+
+    def report(self, elapsed):
+        print('%-6s %6d items %8.1f items/s   busy %7.1f s' % (self.name, self.done, self.done / max(elapsed, 0.001), self.busy))
+
+
+
+class Crawler(object):
+
+    # concurrency = max number of requests in flight, rate/burst = token bucket settings for every host
+    # siteUrl = base for relative links; set it to a local server to crawl saved pages instead of the real site
+    # parsers = number of parsing processes (default: number of cores), queueSize = max items waiting for each stage
+    # context = scra.CrawlContext with log files (scra.prepareLogFiles()), errors are only printed without it
+
+    def __init__(self, concurrency=10, rate=8.0, burst=8, siteUrl=scra.baseUrl, loop=None, parsers=None,
+                 queueSize=None, context=None):
+        self.context = context or scra.CrawlContext()
+        self.loop = loop or asyncio.get_event_loop()
+        self.pool = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.parsers = parsers or os.cpu_count() or 1
+        self.processes = ProcessPoolExecutor(max_workers=self.parsers)
+        self.queueSize = queueSize or 2 * max(concurrency, self.parsers)
+        self.parseQueue = None
+        self.storeQueue = None
+        self.stages = [Stage('fetch'), Stage('parse'), Stage('store')]
+        self.session = fetcher.createSession(poolSize=concurrency)
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.siteUrl = siteUrl
+        self.concurrency = concurrency
+        self.queue = None
+        self.pages = 0
+        self.unchanged = 0
+        self.duplicates = 0
+
+
+    def url(self, link):
+
+        # relative links on the site are relative to its root
+
+        return urljoin(self.siteUrl, link)
+
+
+    def bucket(self, url):
+
+        # one token bucket per host
+
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+
+        return self.buckets[host]
+
+
+    async def fetch(self, url, headers=None):
+
+        # get page, blocking request (with retries) is done in one of the pool threads
+
+        async with self.pool:
+            await self.bucket(url).acquire()
+            page = await self.loop.run_in_executor(self.executor, fetcher.getPage, url, self.session,
+                                                   fetcher.timeout, headers)
+
+        self.pages += 1
+        return page
+
+
+    def add(self, newEntry):
+
+        # page found: save it to frontier and crawl it in this run, unless it's already there
+
+        if frontier.add(newEntry):
+            self.queue.put_nowait(newEntry)
+        else:
+            self.duplicates += 1
+
+        return
+
+
+    async def worker(self):
+
+        # crawl entries from the queue, until it's cancelled
+
+        while True:
+            entry = await self.queue.get()
+            try:
+                await self.crawlEntry(entry)
+            finally:
+                self.queue.task_done()
+
+
+    def startWorkers(self):
+
+        # new queues and tasks of all three stages
+
+        self.queue = asyncio.Queue()
+        self.parseQueue = asyncio.Queue(self.queueSize)
+        self.storeQueue = asyncio.Queue(self.queueSize)
+
+        workers = [self.loop.create_task(self.worker()) for i in range(self.concurrency)]
+        workers += [self.loop.create_task(self.parseWorker()) for i in range(self.parsers)]
+        workers.append(self.loop.create_task(self.storeWorker()))
+
+        return workers
+
+
+    async def drain(self):
+
+        # fetching is done when there is nothing left in the queue, then we wait for the other two stages
+
+        await self.queue.join()
+        await self.parseQueue.join()
+        await self.storeQueue.join()
+
+        return
+
+
+    async def crawlSite(self, entries):
+
+        # crawl given entries and everything found on their pages
+
+        workers = self.startWorkers()
+        try:
+            for entry in entries:
+                self.queue.put_nowait(entry)
+
+            await self.drain()
+        finally:
+            await self.stopWorkers(workers)
+
+        return
+
+
+    async def stopWorkers(self, workers):
+
+        # cancel worker tasks and wait until they are really gone (no pending tasks when the loop is closed)
+
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        return
+
+
+    async def crawlEntry(self, entry):
+
+        # crawl one page from frontier and mark it as done (or failed); attractions and towns only get fetched
+        # here, they are done when they get through the other stages
+
+        try:
+            if entry['kind'] == 'region':
+                await self.crawlRegion(entry)
+            elif entry['kind'] in ('listing', 'towns'):
+                await self.crawlListing(entry)
+            else:
+                await self.fetchItem(entry)
+                return
+            frontier.finish(entry)
+
+        except Exception as e:
+            self.failed(entry, e, 'fetch' if entry['kind'] in ('attraction', 'town') else 'crawl')
+
+        return
+
+
+    def failed(self, entry, e, stage):
+
+        # log error and remember the page as failed
+
+        print('EXCEPTION:', str(e))
+        kind = entry['kind'] if entry['kind'] in ('attraction', 'town') else 'region'
+        self.context.logError(kind, entry['url'], e, stage)
+        frontier.finish(entry, 'failed')
+
+        return
+
+
+    async def crawlRegion(self, entry):
+
+        # get data from individual region, its list of attractions goes to frontier
+
+        page = await self.fetch(entry['url'])
+        newRegion, attrLinks = scra.regionParseData(entry['url'], page)
+
+        regionId = store.saveRegion(newRegion)
+        self.add(frontier.entry(self.url(attrLinks), 'listing', regionId))
+        print('FINISHED WITH REGION', newRegion['name'], '\n---------------------------------------------\n')
+
+        return
+
+
+    async def crawlListing(self, entry):
+
+        # get links from [ Home -> Regions -> Some region -> Attractions ] page OR [ Home -> Towns ] page, including
+        # paginated groups; all items go to frontier, together with their top result flag
+        # (pages of groups are not in frontier, top results are known only while we have the first page)
+
+        page = await self.fetch(entry['url'])
+        attrGroups = scra.pageParseGroups(page)
+
+        # links from the first page of each group (group 1 also sets top results, in context of this list only, as
+        # other lists are crawled at the same time)
+        listContext = self.context.forList()
+        groups = [scra.attractionGroupLinks(node, n, listContext) for n, node in enumerate(attrGroups, 1)]
+        links = [link for attrLinksList, subPageLinks, groupId in groups for link in attrLinksList]
+
+        # links from page 2, 3, .. of all groups
+        subPages = await asyncio.gather(*[self.crawlSubPage(link, groupId)
+                                          for attrLinksList, subPageLinks, groupId in groups
+                                          for link in subPageLinks])
+        for linksPage in subPages:
+            links.extend(linksPage)
+
+        kind = 'town' if entry['kind'] == 'towns' else 'attraction'
+        for link in links:
+            itemUrl = self.url(link)
+            self.add(frontier.entry(itemUrl, kind, entry['region'], listContext.isTopResult(itemUrl)))
+
+        print('Found', len(groups), 'groups - number of items:', len(links), 'on', entry['url'])
+
+        return
+
+
+    async def crawlSubPage(self, link, groupId):
+
+        # links of attractions on one of the other pages of a group
+
+        page = await self.fetch(self.url(link))
+
+        return scra.attrGroupSubPageParse(page, groupId)
+
+
+    async def fetchItem(self, entry):
+
+        # fetch stage: get individual attraction or town, conditional request, skip the page if it didn't change
+        # since the last crawl; waits here while the parse queue is full
+
+        start = time.monotonic()
+        itemUrl = entry['url']
+        page = await self.fetch(itemUrl, recrawl.conditionalHeaders(itemUrl, entry['topResult']))
+        self.stages[0].add(start)
+
+        if recrawl.isUnchanged(itemUrl, page, entry['topResult']):
+            self.unchanged += 1
+            frontier.finish(entry)
+            return
+
+        await self.parseQueue.put((entry, page))
+
+        return
+
+
+    async def parseWorker(self):
+
+        # parse stage: extract data in one of the parsing processes (only the page content is sent there)
+
+        while True:
+            entry, page = await self.parseQueue.get()
+            start = time.monotonic()
+            try:
+                parse = extract.townExtract if entry['kind'] == 'town' else extract.attractionExtract
+                data = await self.loop.run_in_executor(self.processes, parse, page.content)
+                self.stages[1].add(start)
+                metrics.observe('parse_seconds', time.monotonic() - start, kind=entry['kind'])
+                await self.storeQueue.put((entry, page, data))
+
+            except Exception as e:
+                self.failed(entry, e, 'parse')
+
+            finally:
+                self.parseQueue.task_done()
+
+
+    async def storeWorker(self):
+
+        # store stage: rows go to batches (store.py), followed by page state and frontier
+
+        while True:
+            entry, page, data = await self.storeQueue.get()
+            start = time.monotonic()
+            try:
+                itemUrl = entry['url']
+                isTop = entry['topResult']
+                if entry['kind'] == 'town':
+                    newItem = scra.townRow(itemUrl, data, isTop)
+                    store.towns.add(newItem)
+                else:
+                    newItem = scra.attractionRow(itemUrl, data, entry['region'], isTop)
+                    store.attractions.add(newItem)
+                print(newItem['name'], '(', self.pages, 'pages )')
+
+                recrawl.remember(itemUrl, page, isTop)
+                frontier.finish(entry)
+                self.stages[2].add(start)
+
+            except Exception as e:
+                self.failed(entry, e, 'store')
+
+            finally:
+                self.storeQueue.task_done()
+
+
+    def run(self, regionUrls, townsUrl=None, resume=True):
+
+        # crawl given regions (and towns) and report how long it took; if the last crawl didn't finish (and resume
+        # is on) it's continued instead
+        # towns are crawled after all the attractions, they need regions to be in DB already
+
+        store.checkAll()
+        entries = frontier.pending() if resume else []
+        if len(entries) > 0:
+            print('Resuming crawl,', len(entries), 'pages left')
+        else:
+            frontier.clear()
+            entries = [frontier.entry(regionUrl, 'region') for regionUrl in regionUrls]
+            if townsUrl:
+                entries.append(frontier.entry(townsUrl, 'towns'))
+            for entry in entries:
+                frontier.add(entry)
+
+        townKinds = ('towns', 'town')
+        metrics.reset()
+        start = time.time()
+        try:
+            self.loop.run_until_complete(self.crawlSite([e for e in entries if e['kind'] not in townKinds]))
+            self.loop.run_until_complete(self.crawlSite([e for e in entries if e['kind'] in townKinds]))
+
+        except KeyboardInterrupt:
+            print('Crawl stopped, saving progress (run it again to continue)')
+
+        finally:
+            # checkpoint: items first, then the frontier
+            store.flushAll()
+
+        elapsed = time.time() - start
+
+        print('Crawled', self.pages, 'pages in', round(elapsed, 1), 's (', round(self.pages / max(elapsed, 0.001), 1), 'pages/s ),', self.unchanged, 'unchanged,', self.duplicates, 'duplicate links skipped')
+        for stage in self.stages:
+            stage.report(elapsed)
+        metrics.write()
+        self.executor.shutdown()
+        self.processes.shutdown()
+
+        return
+
+
+
+# starting: all regions, then towns (or the rest of the last crawl, if it was stopped)
+#context = scra.prepareLogFiles()
+#import pagecache
+#pagecache.setup('page_cache')                      # save all fetched pages to cache
+#pagecache.setup('page_cache', replayMode=True)     # or: parse pages from cache again, without network
+#metrics.setup('metrics')                          # write metrics.json and metrics.prom every 30 s
+#crawler = Crawler(context=context)
+#frontier.retryFailed()                            # crawl failed pages of the last crawl again as well
+#crawler.run([region + str(scra.lng) for region in scra.regions], scra.townsUrl + str(scra.lng))
@@ -0,0 +1,300 @@
+import zlib
+from functools import lru_cache
+from lxml import html, etree
+
+
+# extracting data from attraction and town pages of www.slovenia.info
+# every page is parsed only once and XPaths of all fields are compiled only once (when module is loaded), then all
+# of them are evaluated on that one tree; results are plain python values, so they can be saved to DB as they are
+# (when a value is shown either as a link or as plain text, both options are in the same expression:
+# '.../a/text() | ...[not(a)]/text()', so the second one is used only when there is no link)
+# descriptions are kept twice: as plain text (for search index) and as compressed HTML (for showing them)
+
+baseUrl = "http://www.slovenia.info"
+baseUrlPictures = "http://www.slovenia.info/"
+
+# text of these elements is separated from the text around it
+blockTags = set(['p', 'div', 'br', 'li', 'ul', 'ol', 'table', 'tr', 'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+
+
+
+# converting list of XPath results to a value of a field; strings are copied, so they don't keep the whole tree alive
+
+def first(values):
+    return str(values[0]) if len(values) > 0 else ''
+
+
+def allValues(values):
+    return [str(value) for value in values]
+
+
+def joined(values):
+    return ''.join(values)
+
+
+def commaJoined(values):
+    return ','.join(values)
+
+
+def elements(values):
+    return values
+
+
+
+def compileFields(fields):
+
+    # fields are given as (name, anchor, XPath, conversion); returns the same list, with compiled XPaths
+
+    return [(name, anchor, etree.XPath(path), convert) for name, anchor, path, convert in fields]
+
+
+
+def mapRow(row):
+
+    # region, destination and place (in the small map box) are links or, sometimes, just text
+
+    path = 'div[2]/div[@class="row ' + row + '"]'
+
+    return path + '/a/text() | ' + path + '[not(a)]/text()'
+
+
+
+# '//*[@id=...]' has to look at every element of the page, so we only do that once for each of the boxes we need;
+# XPaths of fields are relative to one of these anchors ('page' is the whole page)
+anchors = [
+    ('main', etree.XPath('//*[@id="tdMainCenter"]')),
+    ('map', etree.XPath('//*[@id="wpMapSmall"]')),
+]
+
+namePath = 'div[3]/div[1]/div[4]/h1/text()'
+navPath = 'div[1]//a/text()'
+descriptionPath = 'div[3]/div[2]/div[1]'
+picturePath = descriptionPath + '/a/img/@src'
+gpsPath = 'div[2]/div[@class="row gps"]/a/text()'
+propPath = descriptionPath + '/div[1]/div[1]/div[1]'
+townDataPath = descriptionPath + '/div[1]/div[@class="mainTownData"]'
+
+# description has to be the last one, because it gets changed after extraction (other fields are inside of it)
+attractionFields = compileFields([
+    ('name', 'main', namePath, first),
+    ('address', 'main', propPath + '/div[@class="prop propLocation"]/div[2]/text()', first),
+    ('phone', 'main', propPath + '/div[@class="prop propPhone"]/div[2]/text()', first),
+    ('webpage', 'main', propPath + '/div[@class="prop propRow propWWW"]/a/text()', joined),   # in case link is split
+    ('navPath', 'main', navPath, allValues),
+    ('picture', 'main', picturePath, first),
+    ('regionName', 'map', mapRow('region'), first),
+    ('destination', 'map', mapRow('destination'), first),
+    ('place', 'map', mapRow('place'), first),
+    ('gps', 'map', gpsPath, allValues),
+    ('description', 'main', descriptionPath, elements),
+])
+
+townFields = compileFields([
+    ('name', 'main', namePath, first),
+    ('webpage', 'page', '//div[@class="ticItems"]/div[@class="item"]/div[@class="w"]/a/@href', first),  # first info centre
+    ('population', 'main', townDataPath + '/div[@class="item pop"]/div/text()', first),
+    ('altitude', 'main', townDataPath + '/div[@class="item alt"]/div/text()', first),
+    ('position', 'main', townDataPath + '/div[@class="item pos"]/text()', commaJoined),       # more than one possible
+    ('temperature', 'main', townDataPath + '/div[@class="item tmpr"]//span[@class="N3"]/text()', allValues),
+    ('days', 'main', townDataPath + '/div[@class="item sun"]//span[@class="N3"]/text()', allValues),
+    ('navPath', 'main', navPath, allValues),
+    ('picture', 'main', picturePath, first),
+    ('regionName', 'map', mapRow('region'), first),
+    ('destination', 'map', mapRow('destination'), first),
+    ('place', 'map', mapRow('place'), first),
+    ('gps', 'map', gpsPath, allValues),
+    ('description', 'main', descriptionPath, elements),
+])
+
+
+
+def parsePage(content):
+
+    # parse raw page (bytes), lxml decodes it using the charset given in the page
+
+    return html.fromstring(content)
+
+
+
+def extractFields(tree, fields):
+
+    # evaluate all fields on a parsed page (fields of a missing box are empty)
+
+    context = {'page': tree}
+    for anchor, path in anchors:
+        found = path(tree)
+        context[anchor] = found[0] if len(found) > 0 else None
+
+    data = {}
+    for name, anchor, path, convert in fields:
+        node = context[anchor]
+        data[name] = convert(path(node) if node is not None else [])
+
+    return data
+
+
+
+def attractionExtract(content):
+
+    # get data from attraction page; keys are the same as fields in model 'Attraction'
+
+    data = extractFields(parsePage(content), attractionFields)
+    addNavPath(data)
+    addGPS(data)
+
+    # main picture: (we have to merge it with base url for full picture url)
+    if data['picture']:
+        data['picture'] = baseUrlPictures + data['picture']
+
+    data['description'], data['descriptionHtml'] = descriptionContent(data['description'])
+
+    return data
+
+
+
+def townExtract(content):
+
+    # get data from town page; keys are the same as fields in model 'Town'
+
+    data = extractFields(parsePage(content), townFields)
+    addNavPath(data)
+    addGPS(data)
+
+    data['population'] = int(data['population']) if data['population'] else -1
+
+    # temperatures (summer avg, winter avg)
+    temperature = data.pop('temperature') or ['', '']
+    data['tempSummer'] = temperature[0]
+    data['tempWinter'] = temperature[1]
+
+    # number of sunny / rainy days per year
+    days = data.pop('days') or ['-1', '-1']
+    data['sunnyDays'] = int(days[0])
+    data['rainyDays'] = int(days[1])
+
+    # main picture, some of them are already absolute
+    if data['picture'] and not 'www' in data['picture']:
+        data['picture'] = baseUrlPictures + data['picture']
+
+    data['description'], data['descriptionHtml'] = descriptionContent(data['description'])
+
+    return data
+
+
+
+def addNavPath(data):
+
+    # webpage path to item, we remove the first one as its always "Domov" and save the one before last as it tells
+    # us type of item
+
+    navPath = data.pop('navPath')
+    data['type'] = navPath[len(navPath)-2]
+    data['tags'] = ','.join(navPath[1:])
+
+    return data
+
+
+
+def addGPS(data):
+
+    # GPS coordinates, -1 if there are none
+
+    gps = data.pop('gps')
+    if len(gps):
+        data['gpsX'] = float(gps[0].replace(',', '.'))
+        data['gpsY'] = float(gps[1].replace(',', '.'))
+    else:
+        data['gpsX'] = -1
+        data['gpsY'] = -1
+
+    return data
+
+
+
+def descriptionContent(description):
+
+    # we remove unecessary parts (we only need body text); returns plain text and compressed HTML
+    # if we try to remove picture link, we also remove text -> NOT OK! TO-DO: http://stackoverflow.com/questions/22967659/removing-an-element-but-not-the-text-after-it
+
+    childDiv = description[0].find('div')
+    if childDiv is not None:
+        description[0].remove(childDiv)
+
+    # find all relative links in description and replace them with absolute ones
+    descriptionFixed = fixLinks(description[0])
+
+    return descriptionText(descriptionFixed), compressHtml(etree.tostring(descriptionFixed))
+
+
+
+def descriptionText(content):
+
+    # text without markup, whitespace collapsed (text of comments is left out, their tail is not)
+
+    parts = []
+    for event, node in etree.iterwalk(content, events=('start', 'end')):
+        isElement = isinstance(node.tag, str)
+        if isElement and node.tag in blockTags:
+            parts.append(' ')
+
+        if event == 'start' and isElement and node.text:
+            parts.append(node.text)
+        elif event == 'end' and node is not content and node.tail:
+            parts.append(node.tail)
+
+    return ' '.join(''.join(parts).split())
+
+
+
+def compressHtml(content):
+
+    # HTML (bytes) as it's saved to DB
+
+    return zlib.compress(content)
+
+
+
+def decompressHtml(blob):
+
+    # HTML from DB, as text (blob is a memoryview with postgres)
+
+    if blob is None:
+        return ''
+
+    return zlib.decompress(bytes(blob)).decode('utf-8')
+
+
+
+def fixLinks(content):
+
+    # find all links and picture links in description and change them from relative to absolute
+    # (only in content and its children, both attributes in one pass; '//*[@src]' would look at the whole page)
+
+    for node in content.iter(etree.Element):
+        for attribute in ('src', 'href'):
+            url = node.get(attribute)
+            if url is not None:
+                node.set(attribute, join(url))
+
+    return content
+
+
+
+@lru_cache(maxsize=10000)
+def join(url):
+
+    # join relative URL with base URL (same links are on many pages, results are cached)
+
+    if url.startswith("/") and not ("://" in url):
+        # if it starts with /
+        #print('Fixing:', (baseUrl+url))
+        return baseUrl + url
+    elif not ("://" in url or url.startswith("www")):
+        # if it doesn't start with /
+        #print('Fixing:', (baseUrlPictures + url))
+        return baseUrlPictures + url
+    elif url.startswith("www"):
+        return 'http://' + url
+    else:
+        # already absolute
+        return url
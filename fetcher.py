@@ -0,0 +1,100 @@
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import pagecache
+import metrics
+
+
+# shared fetch layer for all scrapers
+# one pooled session (keep-alive, so we don't open a new connection for every page), timeouts, retries with
+# exponential backoff on connection errors and 5xx responses, gzip
+# fetched pages go through the on-disk cache (pagecache.py), if it's turned on
+# every page is counted in metrics.py (status, bytes, latency, retries)
+
+# settings
+poolSize = 10                               # connections kept open per host (should be >= number of fetch threads)
+timeout = (5, 30)                           # (connect, read) in seconds
+retries = 5                                 # max retries for one request
+backoff = 0.5                               # sleep between retries: backoff * 2^(retry - 1) seconds
+retryStatus = [500, 502, 503, 504]          # retry on these responses as well
+headers = {
+    'Accept-Encoding': 'gzip, deflate',
+    'User-Agent': 'ijs_scrapy',
+}
+
+session = None
+
+
+
+def createSession(poolSize=poolSize, retries=retries, backoff=backoff):
+
+    # new session with a connection pool and retry policy mounted for http and https
+
+    retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff, status_forcelist=retryStatus)
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=retry)
+
+    newSession = requests.Session()
+    newSession.headers.update(headers)
+    newSession.mount('http://', adapter)
+    newSession.mount('https://', adapter)
+
+    return newSession
+
+
+
+def getSession():
+    global session
+
+    # shared session, created on first use
+
+    if session is None:
+        session = createSession()
+
+    return session
+
+
+
+def getPage(url, session=None, timeout=timeout, headers=None):
+
+    # GET url using given session (or the shared one); raises an exception if it still fails after all retries
+    # extra headers are for conditional requests (If-None-Match, If-Modified-Since), a 304 response is returned as is
+
+    start = time.monotonic()
+
+    # replay mode: no network at all
+    if pagecache.replay:
+        page = pagecache.load(url)
+        if page is None:
+            raise LookupError('Page is not in cache: ' + url)
+
+    else:
+        if session is None:
+            session = getSession()
+
+        page = session.get(url, timeout=timeout, headers=headers)
+
+        if pagecache.cacheDir:
+            pagecache.save(url, page)
+
+    measure(page, time.monotonic() - start)
+
+    return page
+
+
+
+def measure(page, seconds):
+
+    # metrics of one fetched page; retries are in the urllib3 response (not there for pages from cache)
+
+    metrics.observe('fetch_seconds', seconds)
+    metrics.count('pages_total', status=page.status_code)
+    metrics.count('bytes_total', len(page.content))
+
+    retries = getattr(page.raw, 'retries', None)
+    if retries is not None and len(retries.history) > 0:
+        metrics.count('retries_total', len(retries.history))
+
+    metrics.tick()
+
+    return
@@ -0,0 +1,207 @@
+from models import *
+import store
+
+
+# persistent crawl frontier (table 'frontier')
+# every page the crawler finds (region, list of attractions/towns, single attraction/town) is saved as an entry
+# with its kind, region and status; entries are marked as done after the page is processed, so when a crawl gets
+# stopped, the next one starts with the pages that are still pending instead of crawling everything again
+# entries are written in batches with the rest of the rows (store.py) and after them; if writing an item fails, its
+# entry (still in the same batch) is marked failed instead of done, so retryFailed() can crawl it again; a page can
+# be fetched again if the crawl gets killed in between two batches
+# the same attraction (or town) is linked from lists of more regions and groups, with different urls; their entries
+# are unique by kind and the last part of their url (same as top results are compared), so every page is fetched
+# only once in a crawl (also when it's resumed); other pages (regions, lists) are unique by kind and full url
+# entries are plain dicts: {'url', 'key', 'kind', 'region', 'topResult'}
+
+# keys of all entries in frontier, loaded once
+seen = None
+
+# new entries: if a page is already in the frontier (from this or an earlier run), it's left as it is
+found = store.RowBuffer(Frontier, ['key'], update=False)
+
+# entries with a new status
+finished = store.RowBuffer(Frontier, ['key'])
+
+
+
+# kinds of entries for single items, the same item has different urls on different lists
+itemKinds = ['attraction', 'town']
+
+
+
+def urlKey(url, kind):
+    if kind in itemKinds:
+        return kind + ':' + url.split('/')[-1]
+
+    return kind + ':' + url
+
+
+
+def entry(url, kind, region=None, topResult=False):
+    return {'url': url, 'key': urlKey(url, kind), 'kind': kind, 'region': region, 'topResult': topResult}
+
+
+
+def itemFailed(model, row):
+
+    # attraction or town couldn't be written to DB (store.py failedHooks): its entry is failed, not done
+
+    kind = 'town' if model is Town else 'attraction'
+    failedEntry = entry(row['link'], kind, row.get('region') if kind == 'attraction' else None, row.get('topResult', False))
+    finished.rows[(failedEntry['key'],)] = dict(failedEntry, status='failed')
+
+    return
+
+
+
+store.attractions.failedHooks.append(itemFailed)
+store.towns.failedHooks.append(itemFailed)
+
+
+
+def loadSeen():
+    global seen
+
+    if seen is None:
+        Frontier.create_table(fail_silently=True)
+        seen = set(row.key for row in Frontier.select(Frontier.key))
+
+    return seen
+
+
+
+def pending():
+
+    # entries that still have to be crawled, in the order they were found (leased ones as well, when a crawl of
+    # more workers is continued by one process)
+
+    Frontier.create_table(fail_silently=True)
+    query = Frontier.select().where(Frontier.status << ['pending', 'leased']).order_by(Frontier.id)
+
+    return [entry(row.url, row.kind, row.region, row.topResult) for row in query]
+
+
+
+def add(newEntry):
+
+    # page found, save it as pending; returns False if it's already in frontier (then it doesn't have to be crawled)
+
+    if newEntry['key'] in loadSeen():
+        return False
+
+    seen.add(newEntry['key'])
+    found.add(dict(newEntry, status='pending'))
+
+    return True
+
+
+
+def finish(oldEntry, status='done'):
+
+    # page crawled (status 'done') or not (status 'failed')
+
+    finished.add(dict(oldEntry, status=status))
+
+    return
+
+
+
+def clear():
+    global seen
+
+    # forget the last crawl, so the next one starts from the beginning
+
+    Frontier.create_table(fail_silently=True)
+    Frontier.delete().execute()
+    seen = set()
+
+    return
+
+
+
+def retryFailed():
+
+    # pages that failed in the last crawl are crawled again with the next resumed crawl
+
+    return Frontier.update(status='pending').where(Frontier.status == 'failed').execute()
+
+
+
+# shared frontier for more workers (worker.py)
+# a worker takes (leases) a batch of pending entries with 'SELECT ... FOR UPDATE SKIP LOCKED', so two workers never
+# get the same entry and nobody waits for locks; leases are extended with heartbeats while the worker is alive and
+# entries with an expired lease (worker died) go back to pending
+
+townKinds = ['towns', 'town']
+
+
+
+def sqlNames():
+
+    # quoted table and column names of Frontier
+
+    compiler = Frontier._meta.database.compiler()
+    columns = {name: compiler.quote(field.db_column) for name, field in Frontier._meta.fields.items()}
+
+    return compiler.quote(Frontier._meta.db_table), columns
+
+
+
+def claim(owner, count, leaseSeconds, towns=False):
+
+    # lease up to 'count' pending entries (of towns or of everything else), returns them as entries
+
+    table, c = sqlNames()
+    kindMark = ', '.join(['%s'] * len(townKinds))
+    sql = ('UPDATE %s SET %s = %%s, %s = %%s, %s = now() + %%s * interval \'1 second\' '
+           'WHERE %s IN (SELECT %s FROM %s WHERE %s = %%s AND %s %s (%s) ORDER BY %s LIMIT %%s FOR UPDATE SKIP LOCKED) '
+           'RETURNING %s, %s, %s, %s') % (
+        table, c['status'], c['leaseOwner'], c['leaseUntil'],
+        c['id'], c['id'], table, c['status'], c['kind'], 'IN' if towns else 'NOT IN', kindMark, c['id'],
+        c['url'], c['kind'], c['region'], c['topResult'])
+
+    database = Frontier._meta.database
+    with database.atomic():
+        cursor = database.execute_sql(sql, ['leased', owner, leaseSeconds, 'pending'] + townKinds + [count])
+        rows = cursor.fetchall()
+
+    return [entry(url, kind, region, topResult) for url, kind, region, topResult in rows]
+
+
+
+def extendLeases(owner, leaseSeconds):
+
+    # heartbeat: worker is still working on its entries
+
+    table, c = sqlNames()
+    sql = 'UPDATE %s SET %s = now() + %%s * interval \'1 second\' WHERE %s = %%s AND %s = %%s' % (
+        table, c['leaseUntil'], c['leaseOwner'], c['status'])
+
+    return Frontier._meta.database.execute_sql(sql, [leaseSeconds, owner, 'leased']).rowcount
+
+
+
+def requeueExpired():
+
+    # entries of workers that stopped sending heartbeats go back to pending
+
+    table, c = sqlNames()
+    sql = 'UPDATE %s SET %s = %%s, %s = NULL, %s = NULL WHERE %s = %%s AND %s < now()' % (
+        table, c['status'], c['leaseOwner'], c['leaseUntil'], c['status'], c['leaseUntil'])
+
+    return Frontier._meta.database.execute_sql(sql, ['pending', 'leased']).rowcount
+
+
+
+def remaining(towns=None):
+
+    # number of entries that are not crawled yet (pending or leased), of towns, of everything else or all
+
+    query = Frontier.select().where(Frontier.status << ['pending', 'leased'])
+    if towns is True:
+        query = query.where(Frontier.kind << townKinds)
+    elif towns is False:
+        query = query.where(~(Frontier.kind << townKinds))
+
+    return query.count()
@@ -0,0 +1,145 @@
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import Levenshtein
+
+
+# list of all towns in Slovenia, saved as a sorted string table (built by kraji_scra.py)
+# file: 'GAZ1', number of words, offsets of words (uint32, little endian) and words (utf-8), sorted by their bytes
+# the file is memory mapped, so loading it costs nothing and nothing is unpickled; words are found with binary
+# search (membership and prefix in O(log n)), fuzzy lookup only compares words with the same prefix
+# Gazetteer.suggest() has the same arguments as whoosh's ListCorrector.suggest(), closest words come first
+
+magic = b'GAZ1'
+header = struct.Struct('<4sI')
+offset = struct.Struct('<I')
+
+defaultPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kraji_slovenija.gaz')
+legacyPaths = ['kraji_slovenija', '../kraji_slovenija']                                       # old pickled list
+
+
+
+def build(words, path=defaultPath):
+
+    # save words (lowercase them before, if needed) to a new gazetteer file
+
+    data = sorted(set(word.encode('utf-8') for word in words))
+
+    offsets = [0]
+    for word in data:
+        offsets.append(offsets[-1] + len(word))
+
+    content = header.pack(magic, len(data)) + struct.pack('<%dI' % len(offsets), *offsets) + b''.join(data)
+
+    # temp file + rename, a running search never sees half of the file
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(content)
+    os.replace(tmpPath, path)
+
+    return len(data)
+
+
+
+def load(path=defaultPath):
+
+    # open gazetteer; if there is only the old pickled list, the gazetteer is built from it first
+
+    if not os.path.exists(path) and path == defaultPath:
+        for legacyPath in legacyPaths:
+            if os.path.exists(legacyPath):
+                with open(legacyPath, 'rb') as fp:
+                    build(pickle.load(fp), path)
+                break
+
+    return Gazetteer(path)
+
+
+
+class Gazetteer(object):
+
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        fileMagic, self.count = header.unpack_from(self.data, 0)
+        if fileMagic != magic:
+            raise ValueError('Not a gazetteer file: ' + path)
+
+        self.offsetsStart = header.size
+        self.wordsStart = header.size + offset.size * (self.count + 1)
+
+
+    def raw(self, i):
+
+        # word i, as bytes
+
+        start, end = struct.unpack_from('<2I', self.data, self.offsetsStart + offset.size * i)
+
+        return self.data[self.wordsStart + start:self.wordsStart + end]
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __getitem__(self, i):
+        return self.raw(i).decode('utf-8')
+
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+    def lowerBound(self, key):
+
+        # index of the first word >= key (bytes)
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.raw(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+
+    def __contains__(self, word):
+        key = word.encode('utf-8')
+        i = self.lowerBound(key)
+
+        return i < self.count and self.raw(i) == key
+
+
+    def withPrefix(self, prefix):
+
+        # all words that start with prefix, in order
+
+        key = prefix.encode('utf-8')
+        for i in range(self.lowerBound(key), self.count):
+            word = self.raw(i)
+            if not word.startswith(key):
+                break
+            yield word.decode('utf-8')
+
+
+    def suggest(self, text, limit=5, maxdist=2, prefix=0):
+
+        # words within edit distance 'maxdist' of text that share first 'prefix' letters with it, closest first
+        # (same words, alphabetically)
+
+        candidates = self.withPrefix(text[:prefix]) if prefix > 0 else iter(self)
+
+        found = []
+        for word in candidates:
+            if abs(len(word) - len(text)) <= maxdist:
+                distance = Levenshtein.distance(text, word)
+                if distance <= maxdist:
+                    found.append((distance, word))
+
+        return [word for distance, word in sorted(found)[:limit]]
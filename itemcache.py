@@ -0,0 +1,170 @@
+import collections
+import datetime
+import threading
+import time
+import metrics
+
+
+# read-through cache of items from DB (getFromDB(), getManyFromDB()) for the web app, keyed by (type, id)
+# size is limited (least recently used items are dropped first) and every item is kept at most 'ttl' seconds
+# items change only when the crawler writes them and every write sets their timestamp, so every 'checkSeconds' the
+# cache asks DB for rows with a timestamp not older than the newest one it has seen minus 'slackSeconds' and drops
+# those it didn't see yet; timestamps come from the clocks of the writers and are set before commit, so a row can
+# show up with an older timestamp than rows seen before (late commit, clock behind), the slack catches those
+# bump() starts a new generation (after a crawl in the same process): everything cached before is dropped
+# hits and misses are counted in metrics.py (item_cache_total{result="hit"|"miss"}), hitRate() is the share of hits
+
+
+
+class ItemCache(object):
+
+    # models = type -> model, toDict = function that turns a row into a cached item
+
+    def __init__(self, models, toDict, size=1000, ttl=600, checkSeconds=30, slackSeconds=120):
+        self.models = models
+        self.toDict = toDict
+        self.size = size
+        self.ttl = ttl
+        self.checkSeconds = checkSeconds
+        self.slack = datetime.timedelta(seconds=slackSeconds)
+
+        self.items = collections.OrderedDict()      # (type, id) -> (item, time it was loaded, generation)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.lastCheck = 0
+        self.newest = {}                            # type -> newest timestamp seen in DB
+        self.recent = {}                            # type -> (id, timestamp) of rows within slack of newest
+
+
+    def getMany(self, items):
+
+        # items (list of (type, id)) in the same order, None for unknown types and ids; missing items are loaded
+        # with one query per type
+
+        self.checkChanges()
+
+        now = time.time()
+        found = {}
+        missing = {}
+        with self.lock:
+            for key in items:
+                cached = self.items.get(key)
+                if cached is not None and now - cached[1] < self.ttl and cached[2] == self.generation:
+                    self.items.move_to_end(key)
+                    found[key] = cached[0]
+                elif key[0] in self.models:
+                    missing.setdefault(key[0], set()).add(key[1])
+
+            generation = self.generation
+
+        loaded = self.load(missing)
+        self.store(loaded, now, generation)
+        found.update(loaded)
+
+        hits = len(items) - sum(len(ids) for ids in missing.values())
+        self.count(hits, len(items) - hits)
+
+        # copies, so callers can't change cached items
+        return [dict(found[key]) if key in found else None for key in items]
+
+
+    def get(self, type, id):
+        return self.getMany([(type, id)])[0]
+
+
+    def load(self, missing):
+
+        # {type: ids} -> {(type, id): item}, one query per type
+
+        loaded = {}
+        for type, ids in missing.items():
+            model = self.models[type]
+            for row in model.select().where(model.id << list(ids)):
+                loaded[(type, row.id)] = self.toDict(row)
+
+        return loaded
+
+
+    def store(self, loaded, now, generation):
+
+        with self.lock:
+            # items loaded before a bump() are not cached
+            if generation != self.generation:
+                return
+
+            for key, item in loaded.items():
+                self.items[key] = (item, now, generation)
+                self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+    def count(self, hits, misses):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+        if hits:
+            metrics.count('item_cache_total', hits, result='hit')
+        if misses:
+            metrics.count('item_cache_total', misses, result='miss')
+        metrics.tick()
+
+
+    def hitRate(self):
+        with self.lock:
+            return self.hits / max(self.hits + self.misses, 1)
+
+
+    def invalidate(self, type, id):
+        with self.lock:
+            self.items.pop((type, id), None)
+
+
+    def bump(self):
+
+        # new crawl generation, nothing cached before is used any more
+
+        with self.lock:
+            self.generation += 1
+            self.items.clear()
+
+        return self.generation
+
+
+    def checkChanges(self):
+
+        # drop items that were written to DB since the last check (at most once every checkSeconds)
+
+        now = time.time()
+        with self.lock:
+            if now - self.lastCheck < self.checkSeconds:
+                return 0
+            self.lastCheck = now
+
+        changed = 0
+        for type, model in self.models.items():
+            newest = self.newest.get(type)
+            if newest is None:
+                # first check: only remember where we are (rows within slack count as seen)
+                newest = model.select(model.timestamp).order_by(model.timestamp.desc()).scalar(convert=True)
+                if newest is not None:
+                    self.newest[type] = newest
+                    self.recent[type] = set(model.select(model.id, model.timestamp)
+                                            .where(model.timestamp >= newest - self.slack).tuples())
+                continue
+
+            rows = set(model.select(model.id, model.timestamp).where(model.timestamp >= newest - self.slack).tuples())
+            for id, timestamp in rows - self.recent[type]:
+                self.invalidate(type, id)
+                self.newest[type] = max(self.newest[type], timestamp)
+                changed += 1
+            self.recent[type] = rows
+
+        if changed:
+            metrics.count('item_cache_invalidated_total', changed)
+
+        return changed
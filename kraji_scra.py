@@ -1,10 +1,10 @@
-import requests
+from fetcher import getPage
 from lxml import etree
-import pickle
+import gazetteer
 
 # getting all towns in Slovenia from 'http://www.itis.si/Kraji'
 
-page = requests.get('http://www.itis.si/Kraji')
+page = getPage('http://www.itis.si/Kraji')
 elTree = etree.HTML(page.text)
 
 places = elTree.xpath('//*[@id="core"]/section[2]/div[2]/article//li/a/text()')
@@ -12,8 +12,7 @@ print(places)
 print('Count:', len(places))
 
 # lowercase
-places = sorted([place.lower() for place in places])
+places = [place.lower() for place in places]
 
-# saving to file
-with open('kraji_slovenija', 'wb') as fp:
-    pickle.dump(places, fp)
+# saving to file (gazetteer, sorted there)
+gazetteer.build(places)
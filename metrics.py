@@ -0,0 +1,244 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# crawl metrics: counters and histograms, shared by the scraper, crawler, fetch layer and store
+# they are written (if setup() was called) every 'interval' seconds and at the end of a crawl, as a JSON summary
+# ('metrics.json') and as a Prometheus text file ('metrics.prom', for node_exporter's textfile collector), so we
+# can see if a slow crawl waits for the network, the parser or the DB
+# metrics are updated from fetch threads as well, so everything goes through one lock
+#
+# what we measure:
+#   pages_total{status}                 fetched pages, by HTTP status
+#   bytes_total                         downloaded bytes (body, after decompressing)
+#   retries_total                       retries of requests (connection errors, 5xx)
+#   errors_total{stage, kind}           failed pages, by stage (fetch, parse, store, crawl) and kind of page
+#   fetch_seconds                       fetch latency (including retries)
+#   parse_seconds{kind}                 parse time per page, by kind (region, list, attraction, town)
+#   db_write_seconds{model}             time of one batch write
+#   db_rows_total{model}                rows written
+#   item_cache_total{result}            item lookups of the web app (itemcache.py), hit or miss
+#   item_cache_invalidated_total        cached items dropped because the crawler wrote them again
+
+prefix = 'scraper_'
+
+# upper bounds of histogram buckets, in seconds
+buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+outputDir = None                # None = metrics are only kept in memory
+interval = 30                   # seconds between writes
+
+counters = {}                   # (name, labels) -> value
+histograms = {}                 # (name, labels) -> [count of each bucket, count, sum]
+started = time.time()
+lastWrite = 0
+lock = threading.Lock()
+
+
+
+def setup(directory, everySeconds=interval):
+    global outputDir, interval
+
+    # write metrics to given directory
+
+    outputDir = directory
+    interval = everySeconds
+    os.makedirs(outputDir, exist_ok=True)
+
+    return
+
+
+
+def reset():
+    global started, lastWrite
+
+    # start measuring again (new crawl)
+
+    with lock:
+        counters.clear()
+        histograms.clear()
+        started = time.time()
+        lastWrite = 0
+
+    return
+
+
+
+def labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+
+def count(name, value=1, **labels):
+
+    # add value to counter
+
+    key = (name, labelKey(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+    return
+
+
+
+def observe(name, seconds, **labels):
+
+    # add one measurement to histogram
+
+    key = (name, labelKey(labels))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * len(buckets), 0, 0.0]
+
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                histogram[0][i] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+
+    return
+
+
+
+def timer(name, **labels):
+
+    # with metrics.timer('parse_seconds', kind='town'): ...
+
+    return Timer(name, labels)
+
+
+
+class Timer(object):
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        observe(self.name, time.monotonic() - self.start, **self.labels)
+        return False
+
+
+
+def total(name):
+
+    # sum of counter over all labels
+
+    with lock:
+        return sum(value for (counterName, labels), value in counters.items() if counterName == name)
+
+
+
+def series(name, labels):
+
+    # name of one series in Prometheus text format: scraper_name{label="value",...}
+
+    if len(labels) == 0:
+        return prefix + name
+
+    return prefix + name + '{' + ','.join('%s="%s"' % (label, str(value).replace('"', '\\"')) for label, value in labels) + '}'
+
+
+
+def summary():
+
+    # all metrics as one dict (for JSON)
+
+    elapsed = time.time() - started
+    pages = total('pages_total')
+
+    with lock:
+        data = {
+            'time': time.time(),
+            'elapsed': round(elapsed, 3),
+            'pagesPerSecond': round(pages / max(elapsed, 0.001), 3),
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(counters.items())],
+            'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram[1],
+                            'sum': round(histogram[2], 6),
+                            'avg': round(histogram[2] / histogram[1], 6) if histogram[1] else 0,
+                            'buckets': dict(zip([str(bound) for bound in buckets], histogram[0]))}
+                           for (name, labels), histogram in sorted(histograms.items())],
+        }
+
+    return data
+
+
+
+def prometheusText():
+
+    # all metrics in Prometheus text format
+
+    lines = []
+    with lock:
+        lastName = None
+        for (name, labels), value in sorted(counters.items()):
+            if name != lastName:
+                lines.append('# TYPE %s%s counter' % (prefix, name))
+                lastName = name
+            lines.append('%s %s' % (series(name, labels), value))
+
+        lastName = None
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name != lastName:
+                lines.append('# TYPE %s%s histogram' % (prefix, name))
+                lastName = name
+            for bound, bucketCount in zip(buckets, histogram[0]):
+                lines.append('%s %d' % (series(name + '_bucket', labels + (('le', str(bound)),)), bucketCount))
+            lines.append('%s %d' % (series(name + '_bucket', labels + (('le', '+Inf'),)), histogram[1]))
+            lines.append('%s %f' % (series(name + '_sum', labels), histogram[2]))
+            lines.append('%s %d' % (series(name + '_count', labels), histogram[1]))
+
+    return '\n'.join(lines) + '\n'
+
+
+
+def writeFile(path, text):
+
+    # temp file + rename, so a collector never reads half of the file
+
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(text)
+    # mkstemp makes the file readable only by us, collectors (node_exporter) run as other users
+    os.chmod(tmpPath, 0o644)
+    os.replace(tmpPath, path)
+
+    return
+
+
+
+def write():
+    global lastWrite
+
+    # write both files now
+
+    if outputDir is None:
+        return
+
+    lastWrite = time.time()
+    writeFile(os.path.join(outputDir, 'metrics.json'), json.dumps(summary(), indent=2))
+    writeFile(os.path.join(outputDir, 'metrics.prom'), prometheusText())
+
+    return
+
+
+
+def tick():
+
+    # called after every page (and every cache lookup), writes files if it's time for it
+
+    if outputDir is not None and time.time() - lastWrite >= interval:
+        write()
+
+    return
@@ -0,0 +1,152 @@
+from peewee import *
+from playhouse.migrate import SchemaMigrator, migrate
+from models import *
+
+
+# brings a DB that was created with an older models.py up to date (initDB() already creates a new DB like this)
+# models.py is what the DB should look like: missing tables are created, missing columns added and missing indexes
+# (field index/unique, Meta.indexes) built; before a unique index is built, duplicated rows are removed (the newest
+# one is kept, like an upsert would do)
+# every step looks at the DB first, so migrations can be run again any time, they only do what is still missing
+# run: python migrations.py
+
+models = [Region, Attraction, Town, Page, Frontier, CrawlWorker]
+
+# columns added after the first version of the models, they get added to old tables
+newColumns = [
+    (Region, 'descriptionHtml'),
+    (Attraction, 'descriptionHtml'),
+    (Town, 'descriptionHtml'),
+    (Frontier, 'leaseOwner'),
+    (Frontier, 'leaseUntil'),
+]
+
+
+
+def columnNames(model, names):
+
+    # field names (or fields) -> column names in DB
+
+    return tuple(model._meta.fields[name].db_column if isinstance(name, str) else name.db_column for name in names)
+
+
+
+def wantedIndexes(model):
+
+    # (columns, unique) of every index the model defines
+
+    return [(columnNames(model, fields), unique) for fields, unique in model._index_data()]
+
+
+
+def createTables(db):
+
+    created = []
+    for model in models:
+        if not model.table_exists():
+            model.create_table()
+            created.append(model._meta.db_table)
+
+    return created
+
+
+
+def addColumns(db):
+
+    migrator = SchemaMigrator.from_database(db)
+
+    added = []
+    for model, name in newColumns:
+        field = model._meta.fields[name]
+        table = model._meta.db_table
+        if field.db_column not in [column.name for column in db.get_columns(table)]:
+            migrate(migrator.add_column(table, field.db_column, field))
+            added.append(table + '.' + field.db_column)
+
+    return added
+
+
+
+def removeDuplicates(db, model, columns):
+
+    # keep only the newest row of every group of rows with the same 'columns'; rows that point to removed
+    # regions are moved to the kept ones
+
+    table = model._meta.db_table
+    quote = db.compiler().quote
+    groupBy = ', '.join(quote(column) for column in columns)
+    duplicates = ('SELECT id FROM %s WHERE id NOT IN (SELECT MAX(id) FROM %s GROUP BY %s)' %
+                  (quote(table), quote(table), groupBy))
+
+    removed = len(db.execute_sql(duplicates).fetchall())
+    if removed == 0:
+        return 0
+
+    with db.atomic():
+        for related in model._meta.reverse_rel.values():
+            relatedTable = quote(related.model_class._meta.db_table)
+            same = ' AND '.join('old.%s = kept.%s' % (quote(column), quote(column)) for column in columns)
+            db.execute_sql('UPDATE %s SET %s = (SELECT MAX(kept.id) FROM %s AS old, %s AS kept WHERE old.id = %s.%s AND %s) '
+                           'WHERE %s IN (%s)' % (relatedTable, quote(related.db_column), quote(table), quote(table),
+                                                 relatedTable, quote(related.db_column), same,
+                                                 quote(related.db_column), duplicates))
+        db.execute_sql('DELETE FROM %s WHERE id IN (%s)' % (quote(table), duplicates))
+
+    print('Removed', removed, 'duplicated rows from', table, 'on', columns)
+
+    return removed
+
+
+
+def addIndexes(db):
+
+    migrator = SchemaMigrator.from_database(db)
+
+    added = []
+    for model in models:
+        table = model._meta.db_table
+        # columns of an index come back from Postgres in no particular order, so they are compared as sets
+        indexes = db.get_indexes(table)
+        existing = [(frozenset(index.columns), index.unique) for index in indexes]
+        names = [index.name for index in indexes]
+        for columns, unique in wantedIndexes(model):
+            # an unique index is good enough where we only need an index
+            if (frozenset(columns), unique) in existing or (frozenset(columns), True) in existing:
+                continue
+            # index with the name we would give it is there already (made by hand or with other columns)
+            if db.compiler().index_name(table, columns) in names:
+                continue
+
+            if unique:
+                removeDuplicates(db, model, columns)
+            migrate(migrator.add_index(table, columns, unique))
+            added.append('%s(%s)%s' % (table, ', '.join(columns), ' unique' if unique else ''))
+
+    return added
+
+
+
+def run(db=None):
+
+    # apply everything that is missing, returns list of changes (empty if DB was up to date)
+
+    db = db or BaseModel._meta.database
+
+    changes = createTables(db) + addColumns(db)
+    changes += addIndexes(db)
+
+    # planner needs fresh statistics for new indexes
+    if len(changes) > 0 and isinstance(db, PostgresqlDatabase):
+        db.execute_sql('ANALYZE')
+
+    for change in changes:
+        print('Migrated:', change)
+    if len(changes) == 0:
+        print('DB is up to date')
+
+    return changes
+
+
+
+if __name__ == '__main__':
+    run()
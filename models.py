@@ -1,50 +1,97 @@
 from peewee import *
+from playhouse.pool import PooledPostgresqlDatabase
 import datetime
 
 
+# DB settings, used when the DB is first needed (change them with configure() before that)
+config = {
+    'database': 'slovenia_db',
+    'user': 'adminslo',
+    'password': 'slo',
+    'host': 'localhost',
+    'max_connections': 20,      # open connections in pool (per process), more threads wait for a free one
+    'stale_timeout': 300,       # seconds; older connections are closed instead of reused
+}
+
+
+
+class LazyPooledDatabase(PooledPostgresqlDatabase):
+
+    # pool of connections (every thread takes its own connection from the pool and gives it back on close());
+    # created without settings, they are read from config on the first connect
+
+    def connect(self):
+        if self.deferred:
+            settings = dict(config)
+            self.init(settings.pop('database'), **settings)
+
+        return PooledPostgresqlDatabase.connect(self)
+
+
+database = LazyPooledDatabase(None)
+
+
+
+def configure(**settings):
+
+    # change DB settings (database, user, password, host, max_connections, stale_timeout, ...); open connections
+    # are closed, new ones use the new settings
+
+    config.update(settings)
+    if not database.deferred:
+        database.close_all()
+        database.init(None)
+
+    return
+
+
 
 def connectDB():
-    db = PostgresqlDatabase(
-        'slovenia_db',
-        user='adminslo',
-        password='slo',
-        host='localhost',
-    )
 
-    return db
+    # shared DB of all models; nothing is opened here, a connection is taken from the pool on the first query
+
+    return database
 
 
 def initDB(db):
 
     # create tables
-    db.create_tables([Region, Attraction, Town])
+    db.create_tables([Region, Attraction, Town, Page, Frontier, CrawlWorker])
 
     return
 
 
 class BaseModel(Model):
     class Meta:
-        database = connectDB()
+        database = database
 
 
 class Region(BaseModel):
     name = CharField()
     link = CharField()
-    description = TextField()
+    description = TextField()                   # plain text (for search)
+    descriptionHtml = BlobField(null=True)      # compressed HTML (extract.decompressHtml)
     picture = CharField()
-    timestamp = DateTimeField(default=datetime.datetime.now)
+    timestamp = DateTimeField(default=datetime.datetime.now, index=True)     # itemcache.py looks for new rows
+
+    class Meta:
+        # unique, scraper upserts on it
+        indexes = (
+            (('name',), True),
+        )
 
 
 
 class Attraction(BaseModel):
     name = CharField()
-    link = CharField()
+    link = CharField(index=True)                # getAttraction(), recrawl.py
     address = CharField()
     phone = CharField()
     webpage = CharField()
     tags = CharField()
     type = CharField()
-    description = TextField()
+    description = TextField()                   # plain text (for search)
+    descriptionHtml = BlobField(null=True)      # compressed HTML (extract.decompressHtml)
     picture = CharField()
     regionName = CharField()
     region = ForeignKeyField(Region, related_name='attractions')
@@ -53,12 +100,18 @@ class Attraction(BaseModel):
     gpsX = DoubleField()
     gpsY = DoubleField()
     topResult = BooleanField()
-    timestamp = DateTimeField(default=datetime.datetime.now)
+    timestamp = DateTimeField(default=datetime.datetime.now, index=True)     # itemcache.py looks for new rows
+
+    class Meta:
+        # unique, scraper upserts on it
+        indexes = (
+            (('name', 'regionName'), True),
+        )
 
 
 class Town(BaseModel):
     name = CharField()
-    link = CharField()
+    link = CharField(index=True)                # recrawl.py
     webpage = CharField()
     population = IntegerField()
     altitude = CharField()
@@ -69,7 +122,8 @@ class Town(BaseModel):
     rainyDays = IntegerField()
     tags = CharField()
     type = CharField()
-    description = TextField()
+    description = TextField()                   # plain text (for search)
+    descriptionHtml = BlobField(null=True)      # compressed HTML (extract.decompressHtml)
     picture = CharField()
     regionName = CharField()
     region = ForeignKeyField(Region, related_name='towns')
@@ -78,4 +132,46 @@ class Town(BaseModel):
     gpsX = DoubleField()
     gpsY = DoubleField()
     topResult = BooleanField()
-    timestamp = DateTimeField(default=datetime.datetime.now)
\ No newline at end of file
+    timestamp = DateTimeField(default=datetime.datetime.now, index=True)     # itemcache.py looks for new rows
+
+    class Meta:
+        # unique, scraper upserts on it
+        indexes = (
+            (('name', 'regionName'), True),
+        )
+
+
+class Page(BaseModel):
+    # state of a crawled page (attraction or town), for incremental re-crawl
+    link = CharField(unique=True)
+    etag = CharField(null=True)
+    lastModified = CharField(null=True)
+    contentHash = CharField()
+    topResult = BooleanField()
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+
+class Frontier(BaseModel):
+    # pages the crawler found, with their state, so a stopped crawl can continue where it stopped
+    url = CharField()
+    key = CharField(unique=True)            # kind + last part of url of items (same item has different urls on
+                                            # different lists), kind + url of other pages (frontier.urlKey())
+    kind = CharField()                      # region, listing, towns, attraction, town
+    region = IntegerField(null=True)        # id of region (for lists of attractions and attractions)
+    topResult = BooleanField(default=False)
+    status = CharField(default='pending')   # pending, leased, done, failed
+    leaseOwner = CharField(null=True)       # worker that is crawling it (worker.py)
+    leaseUntil = DateTimeField(null=True)   # after that, other workers can take it
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        # frontier.pending(), claim() and remaining() filter on these
+        indexes = (
+            (('status', 'kind'), False),
+        )
+
+
+class CrawlWorker(BaseModel):
+    # crawl workers sharing the frontier (worker.py), with time of their last heartbeat
+    name = CharField(unique=True)
+    heartbeat = DateTimeField(default=datetime.datetime.now)
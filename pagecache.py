@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+
+# on-disk cache of fetched pages
+# bodies are stored compressed and content-addressed ('objects/<sha1 of body>.gz', same page under two urls is
+# stored once); for every url there is a small record ('urls/<sha1 of url>.json') with url, status, headers and
+# hash of the body
+# in replay mode pages are read only from the cache (no network at all), so the whole site can be parsed again
+# after fixing an XPath, and the cache can be used as a fixed set of pages for benchmarks
+
+cacheDir = None                             # None = don't cache anything
+replay = False                              # True = read from cache only
+
+# headers that describe the transfer, not the page (body in cache is already decompressed)
+skipHeaders = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
+
+
+
+def setup(directory, replayMode=False):
+    global cacheDir, replay
+
+    # turn cache on (every fetched page gets saved) or, with replayMode, read pages only from it
+
+    cacheDir = directory
+    replay = replayMode
+    for subDir in ('urls', 'objects'):
+        os.makedirs(os.path.join(cacheDir, subDir), exist_ok=True)
+
+    return
+
+
+
+def keyPath(kind, key, extension):
+
+    # files are spread over subdirectories by the first two characters of their key
+
+    return os.path.join(cacheDir, kind, key[:2], key + extension)
+
+
+
+def writeFile(path, data):
+
+    # write to temp file first, then rename, so other threads never see half written files
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(data)
+    os.replace(tmpPath, path)
+
+    return
+
+
+
+def save(url, page):
+
+    # save fetched page (only successful responses)
+
+    if page.status_code != 200:
+        return
+
+    bodyHash = hashlib.sha1(page.content).hexdigest()
+    objectPath = keyPath('objects', bodyHash, '.gz')
+    if not os.path.exists(objectPath):
+        writeFile(objectPath, gzip.compress(page.content))
+
+    record = {
+        'url': url,
+        'status': page.status_code,
+        'headers': {key: value for key, value in page.headers.items() if key.lower() not in skipHeaders},
+        'body': bodyHash,
+        'time': time.time(),
+    }
+    urlHash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    writeFile(keyPath('urls', urlHash, '.json'), json.dumps(record).encode('utf-8'))
+
+    return
+
+
+
+def load(url):
+
+    # page from cache, as a regular requests.Response; None if it's not in the cache
+
+    urlHash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    try:
+        with open(keyPath('urls', urlHash, '.json'), 'rb') as fp:
+            record = json.loads(fp.read().decode('utf-8'))
+
+        with open(keyPath('objects', record['body'], '.gz'), 'rb') as fp:
+            content = gzip.decompress(fp.read())
+
+    except FileNotFoundError:
+        return None
+
+    page = requests.Response()
+    page._content = content
+    page.status_code = record['status']
+    page.headers = CaseInsensitiveDict(record['headers'])
+    page.encoding = get_encoding_from_headers(page.headers)
+    page.url = url
+
+    return page
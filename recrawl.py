@@ -0,0 +1,118 @@
+import hashlib
+from models import *
+import store
+import pagecache
+
+
+# incremental re-crawl
+# for every attraction/town page we remember ETag, Last-Modified and a hash of its content (table 'page'); next
+# time we send a conditional request and skip the page (no parsing, no DB write) if the server answers with 304
+# or if the content is the same as before
+# top result flag comes from the list of attractions, not from the page itself, so it's remembered as well
+# when replaying pages from cache (pagecache.replay) all pages are parsed again, that's the point of replaying
+
+known = None
+
+pages = store.RowBuffer(Page, ['link'])
+
+
+
+def itemFailed(model, row):
+
+    # item couldn't be written to DB (store.py failedHooks): forget the new state of its page, so it's not skipped
+    # as unchanged next time
+
+    pages.rows.pop((row['link'],), None)
+    if known is not None:
+        known.pop(row['link'], None)
+
+    return
+
+
+
+store.attractions.failedHooks.append(itemFailed)
+store.towns.failedHooks.append(itemFailed)
+
+
+
+def loadKnown():
+    global known
+
+    # state of all pages from the last crawl, loaded once; only pages whose item is in DB count (if writing the
+    # item failed, we want to get it again)
+
+    if known is None:
+        Page.create_table(fail_silently=True)
+
+        saved = set(item.link for item in Attraction.select(Attraction.link))
+        saved.update(item.link for item in Town.select(Town.link))
+
+        known = {}
+        for page in Page.select():
+            if page.link in saved:
+                known[page.link] = (page.etag, page.lastModified, page.contentHash, page.topResult)
+
+    return known
+
+
+
+def contentHash(page):
+    return hashlib.sha1(page.content).hexdigest()
+
+
+
+def conditionalHeaders(link, topResult):
+
+    # headers for conditional GET, empty if we don't know the page yet or if its top result flag changed (then we
+    # need the whole page, a 304 has nothing to parse and the item has to be written again)
+
+    headers = {}
+    if pagecache.replay:
+        return headers
+
+    state = loadKnown().get(link)
+    if state is not None and state[3] == topResult:
+        etag, lastModified, oldHash, oldTopResult = state
+        if etag:
+            headers['If-None-Match'] = etag
+        if lastModified:
+            headers['If-Modified-Since'] = lastModified
+
+    return headers
+
+
+
+def isUnchanged(link, page, topResult):
+
+    # True if page (response to a conditional request) is the same as last time
+
+    if pagecache.replay:
+        return False
+
+    state = loadKnown().get(link)
+    if state is None:
+        return False
+
+    etag, lastModified, oldHash, oldTopResult = state
+    if topResult != oldTopResult:
+        return False
+
+    return page.status_code == 304 or contentHash(page) == oldHash
+
+
+
+def remember(link, page, topResult):
+
+    # save state of page (after its item was added to store), written in batches like items
+
+    row = {
+        'link': link,
+        'etag': page.headers.get('ETag'),
+        'lastModified': page.headers.get('Last-Modified'),
+        'contentHash': contentHash(page),
+        'topResult': topResult,
+    }
+    pages.add(row)
+    loadKnown()[link] = (row['etag'], row['lastModified'], row['contentHash'], topResult)
+
+    return
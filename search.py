@@ -2,13 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import collections
-import pickle
+import numpy
 import Levenshtein
+import gazetteer
+import spatial
+import searchbackend
+import snapshot
 
 from whoosh.index import create_in, open_dir
 from whoosh.fields import *
-from whoosh.qparser import MultifieldParser, OrGroup, QueryParser
+from whoosh.qparser import QueryParser
 from whoosh.analysis import *
 from whoosh.query import *
 from whoosh.spelling import ListCorrector
@@ -28,6 +33,20 @@ specialWords = sorted(['seznam', 'tabela'])
 commonWords = sorted(['kaj', 'kje', 'kako', 'povej', 'mi', 'pokaži', 'veš', 'lahko', 'je', 'prikaži', 'morda', 'tej', 'ali', 'poznaš'])
 prepositions = sorted(['na', 'v', 'ob', 'pri', 's', 'z', 'bližini', 'blizu', 'zraven'])
 
+# "v bližini": items within this many km of user (spatial.py)
+nearByKm = 10
+
+# lists are ranked by text score * 1 / (1 + km / distanceScaleKm) (score is halved at that distance), computed for
+# 'rankCandidates' best text hits; hits without coordinates count as 'missingKm' away
+distanceScaleKm = 15
+rankCandidates = 200
+missingKm = 30
+
+# building index (init()): rows read from DB per query, processes (one per core) and memory (MB) of each of them
+indexChunkSize = 5000
+indexProcs = os.cpu_count() or 1
+indexMemoryMb = 256
+
 
 
 # schema for attribute entries
@@ -52,18 +71,72 @@ attrSchema = Schema(id=ID(stored=True),
                     )
 
 
-def init():
+def indexQuery(model):
+    # all items of model, without the HTML of description (it's not indexed and it's the biggest column);
+    # description is already plain text
+    return model.select(*[field for field in model._meta.sorted_fields if field.name != 'descriptionHtml'])
+
+
+def streamQuery(model, chunkSize=None):
+    # rows of model in chunks of chunkSize (by id), so the whole table is never in memory
+    chunkSize = chunkSize or indexChunkSize
+    last = 0
+    while True:
+        rows = list(indexQuery(model).where(model.id > last).order_by(model.id).limit(chunkSize))
+        for row in rows:
+            yield row
+        if len(rows) < chunkSize:
+            return
+        last = rows[-1].id
+
+
+def indexRows(model, source=None):
+    # rows of model from DB, or from a snapshot (snapshot.py) when there is one
+    if source is not None:
+        return source.rows(model)
+    return streamQuery(model)
+
+
+class IndexProgress(object):
+    # counts added documents and prints documents/s every 'every' documents
+    def __init__(self, every=10000):
+        self.every = every
+        self.count = 0
+        self.start = time.time()
+
+    def add(self):
+        self.count += 1
+        if self.count % self.every == 0:
+            print('Indexed', self.count, 'documents,', self.rate(), 'documents/s')
+
+    def rate(self):
+        return round(self.count / max(time.time() - self.start, 0.001), 1)
+
+
+def init(snapshotPath=None, procs=indexProcs):
+    # build index from DB, or from a snapshot file without DB (init('snapshot.npz'), see snapshot.py)
+    # with procs > 1, documents are analysed by that many processes, each writes its own segment (no merging at the
+    # end, searcher reads all segments)
+    source = snapshot.load(snapshotPath) if snapshotPath else None
+
     # Create index dir if it does not exists.
     if not os.path.exists("index"):
         os.mkdir("index")
 
     index = create_in("index", attrSchema)
 
-    writer = index.writer()
+    if procs > 1:
+        writer = index.writer(procs=procs, multisegment=True, limitmb=indexMemoryMb)
+    else:
+        writer = index.writer(limitmb=indexMemoryMb)
+    progress = IndexProgress()
+
+    # coordinates of items for spatial index (typeID, id, name, gpsX, gpsY)
+    points = []
 
     # fill index from DB with regions, attractions and towns
-    for attraction in Attraction.select():
-        print(attraction.name, attraction.gpsX, attraction.gpsY)
+    for attraction in indexRows(Attraction, source):
+        points.append(('attraction', attraction.id, attraction.name.lower(), attraction.gpsX, attraction.gpsY))
         writer.add_document(
             id=str(attraction.id).encode("utf-8").decode("utf-8"),
             name=attraction.name,
@@ -83,9 +156,10 @@ def init():
             topResult=False,
             typeID='attraction'
         )
+        progress.add()
 
-    for town in Town.select():
-        print(town.name, town.gpsX, town.gpsY)
+    for town in indexRows(Town, source):
+        points.append(('town', town.id, town.name.lower(), town.gpsX, town.gpsY))
         writer.add_document(
             id=str(town.id).encode("utf-8").decode("utf-8"),
             name=town.name,
@@ -103,9 +177,9 @@ def init():
             topResult=town.topResult,
             typeID='town'
         )
+        progress.add()
 
-    for region in Region.select():
-        print(region.name)
+    for region in indexRows(Region, source):
         writer.add_document(
             id=str(region.id).encode("utf-8").decode("utf-8"),
             name=region.name,
@@ -120,8 +194,16 @@ def init():
             topResult=False,
             typeID='region'
         )
-        
+        progress.add()
+
     writer.commit()
+    print('Index:', progress.count, 'documents in', round(time.time() - progress.start, 1), 's,', progress.rate(), 'documents/s,', procs, 'processes')
+
+    # spatial index for "v bližini" queries, next to Whoosh index
+    if len(points) > 0:
+        spatialIndex = spatial.SpatialIndex(*zip(*points))
+        spatialIndex.save(os.path.join("index", spatial.fileName))
+        print('Spatial index:', len(spatialIndex), 'items with coordinates')
 
     return
 
@@ -306,7 +388,7 @@ def getLocationSuggestion(queryList, prefix=-1):
     # if prefix == -1, automatically calculate prefix for a given word; else, use prefix set by user
 
     correction = None
-    correctorList = ListCorrector(townsStatic)
+    correctorList = townsStatic
     for i, word in enumerate(queryList):
         if len(word) > 2:
             if prefix == -1:
@@ -322,46 +404,95 @@ def getLocationSuggestion(queryList, prefix=-1):
     return queryList, correction
 
 
-def searchIndex(index, newText, resultLimit=1, filterQuery=None):
+def searchIndex(index, newText, resultLimit=1, filterQuery=None, near=None, position=None):
 
     #print('Tekst', newText)
-    # search for a given string
-    with index.searcher() as searcher:
+    # search for a given string (index is a Whoosh index or a backend from searchbackend.py)
+    # near = (lat, lon, km), only items that close are allowed (together with filterQuery)
+    # position = (lat, lon), hits are ranked by text score and distance from it (rankByDistance)
+    backend = searchbackend.get(index)
+
+    candidates = resultLimit if position is None else max(resultLimit, rankCandidates)
+    results = backend.search(newText, candidates, filterQuery, near)
+    print('Number of hits:', len(results))
+
+    # only hits with score bigger than topResultScore for top results (0.5 in Whoosh), bigger than 0 for others
+    results = [hit for hit in results
+               if (hit.fields['topResult'] and hit.score > backend.topResultScore) or (not hit.fields['topResult'] and hit.score > 0)]
 
-        # using MultifieldParser to search all relevant fields
+    if position is not None:
+        return rankByDistance(results, resultLimit, position)
 
-        # in case of multiple words in query, use OR (query: 'lake bled' => 'lake' OR 'bled')
-        # boost score of items that contain both tokens
-        orGroup = OrGroup.factory(0.9)
-        query = MultifieldParser(["name", "type", "regionName", "description", "tags", "topResult", "destination", "place"], index.schema, group=orGroup).parse(newText)
-        results = searcher.search(query, limit=resultLimit, terms=True, filter=filterQuery)
-        print('Number of hits:', len(results))
+    # saving hits to the ordered dict, so we can return it
+    dict = collections.OrderedDict()
 
-        # saving hits (only hits with score bigger than 0.5 - topResult value) to the ordered dict, so we can return it
-        dict = collections.OrderedDict()
+    for i, hit in enumerate(results):
+        result = hit.fields
+        print(result['name'], ',', result['place'], ',', result['destination'], ',', result['regionName'], ',', result['type'], ',', result['webpage'], '; ', 'SCORE:', hit.score)
+        dict[i] = hitDict(result, hit.score)
 
-        hasResult = False
-        for i, result in enumerate(results):
-            if (result['topResult'] and float(results.score(i)) > 0.5) or (not result['topResult'] and float(results.score(i)) > 0):
-                hasResult = True
-                print(result['name'], ',', result['place'], ',', result['destination'], ',', result['regionName'], ',', result['type'], ',', result['webpage'], '; ', 'SCORE:', results.score(i), 'MATCHED TERMS:', result.matched_terms())
-                dict[i] = {'id': result['id'], 'name': result['name'], 'link': result['link'], 'type': result['type'], 'regionName': result['regionName'], 'destination': result['destination'], 'place': result['place'], 'typeID': result['typeID'], 'description': result['description'], 'webpage': result['webpage'], 'exactHit': False, 'suggestion': False, 'suggestionText': None, 'score': results.score(i)}
+    if len(dict) == 0:
+        print('___ NO RESULTS ___')
 
-        if hasResult == False:
-            print('___ NO RESULTS ___')
+    return dict
 
+
+def rankByDistance(results, resultLimit, position):
+
+    # best 'resultLimit' hits by text score and distance from position, all candidates in one pass
+
+    dict = collections.OrderedDict()
+    if len(results) == 0:
+        print('___ NO RESULTS ___')
         return dict
 
+    scores = numpy.array([hit.score for hit in results], dtype=numpy.float64)
+    km = spatial.distances(position[0], position[1], numpy.array([hit.lat for hit in results], dtype=numpy.float64),
+                           numpy.array([hit.lon for hit in results], dtype=numpy.float64))
+
+    combined = scores / (1 + numpy.where(numpy.isnan(km), missingKm, km) / distanceScaleKm)
+    order = numpy.argsort(-combined, kind='mergesort')[:resultLimit]
+
+    for rank, n in enumerate(order):
+        result = results[n].fields
+        distance = None if numpy.isnan(km[n]) else round(float(km[n]), 2)
+        print(result['name'], ',', result['place'], ',', result['regionName'], ',', result['type'], '; ', 'SCORE:', scores[n], 'DISTANCE:', distance, 'RANK SCORE:', combined[n])
+        dict[rank] = hitDict(result, float(combined[n]))
+        dict[rank]['distance'] = distance
+
+    return dict
+
+
+def hitDict(fields, score):
+
+    # one hit for results, from stored fields of Whoosh document (or a row with the same fields)
+
+    return {'id': fields['id'], 'name': fields['name'], 'link': fields['link'], 'type': fields['type'], 'regionName': fields['regionName'], 'destination': fields['destination'], 'place': fields['place'], 'typeID': fields['typeID'], 'description': fields['description'], 'webpage': fields['webpage'], 'exactHit': False, 'suggestion': False, 'suggestionText': None, 'score': score}
+
+
+def searchNearest(index, position, resultLimit, km):
+
+    # closest items to position (lat, lon), when text search has nothing near user
+
+    dict = collections.OrderedDict()
+    for hit in searchbackend.get(index).nearest(position[0], position[1], resultLimit, km):
+        dict[len(dict)] = hitDict(hit.fields, 0)
+        print(hit.fields['name'], '; DISTANCE:', round(float(spatial.distances(position[0], position[1], hit.lat, hit.lon)), 2), 'km')
+
+    return dict
+
 
 def analyzeQuery(index, query, locationAssistant=None):
 
     # search starts here
     print('Original search query:', query, '\n')
 
-    # simulating test data
-    # MUST be lowercase!
-    locationAssistant = 'Ljubljana'
-    locationAssistant = locationAssistant.lower()
+    # simulating test data (when assistant doesn't tell us where user is)
+    # name of a town (MUST be lowercase!) or position (gpsX, gpsY)
+    if locationAssistant is None:
+        locationAssistant = 'Ljubljana'
+    if isinstance(locationAssistant, str):
+        locationAssistant = locationAssistant.lower()
 
     # check for empty / non-existent query
     if not query or query.isspace():
@@ -420,8 +551,21 @@ def analyzeQuery(index, query, locationAssistant=None):
     # if limit = 10, we want to make search a bit more general because a stopword/plural was detected, since we need
     # more results based on type, not name (probably)
     filterQuery = None
+    near = None
+    rankPosition = None         # results are ranked by text score and distance from here
     if limit == 10:
-        text, gotLocation, locationFilter, typeFilter, correctedLocation, globalFilter = multipleResultsAnalyzer(index, text)
+        text, gotLocation, locationFilter, typeFilter, correctedLocation, globalFilter, nearBy = multipleResultsAnalyzer(index, text)
+
+        # where user is (if we know the place from locationAssistant)
+        backend = searchbackend.get(index)
+        position = backend.position(locationAssistant)
+
+        # "v bližini": instead of location filter by name, take items within 'nearByKm' of user
+        if nearBy and position is not None:
+            print('Searching near', locationAssistant, position)
+            near = (position[0], position[1], nearByKm)
+            rankPosition = position
+            globalFilter = True
 
         # in case we already have a location match from 'findMatch', we'd rather use that since we know it definitely
         # matches a place in Slovenia
@@ -430,12 +574,17 @@ def analyzeQuery(index, query, locationAssistant=None):
         #   gotLocation = 2
         #   correctedLocation = correction
 
-        # if no location filter is set yet, use the default one (if available)
+        # if no location filter is set yet, rank results by distance from user; if we don't know where user is, use
+        # the default location filter (if available)
         # - except when we don't want one (when user adds '...v Sloveniji' or similar)
         if locationFilter == None and globalFilter is False:
-            locationFilter = setDefaultLocationFilter(locationAssistant, 'place')
-            gotLocation = 2
-            correctedLocation = locationAssistant
+            if position is not None:
+                print('Ranking by distance from', locationAssistant, position)
+                rankPosition = position
+            elif isinstance(locationAssistant, str):
+                locationFilter = setDefaultLocationFilter(locationAssistant, 'place')
+                gotLocation = 2
+                correctedLocation = locationAssistant
 
         filterQuery = joinFilters(typeFilter, locationFilter)
 
@@ -453,13 +602,25 @@ def analyzeQuery(index, query, locationAssistant=None):
     print('New user query after analysis:', text)
 
     # get results; if empty, change location filters
-    hits = searchIndex(index, text, limit, filterQuery)
+    hits = searchIndex(index, text, limit, filterQuery, near, rankPosition)
     if len(hits) == 0:
         if limit == 1:
             print('No hits!')
 
+        # nothing matching the text near user, so just give the closest items; if there's nothing near user,
+        # search everywhere (closest first)
+        elif near is not None:
+            hits = searchNearest(index, position, limit, nearByKm)
+            if len(hits) == 0:
+                hits = searchIndex(index, text, limit, typeFilter, position=position)
+
+        # location from query is a town we know: instead of widening location filter, search without it and rank
+        # results by distance from that town
+        elif limit == 10 and correctedLocation and backend.position(correctedLocation) is not None:
+            hits = searchIndex(index, text, limit, typeFilter, position=backend.position(correctedLocation))
+
         # more-than-one-result search
-        elif limit == 10:
+        elif limit == 10 and correctedLocation:
             # returns 3 location filter options: place, destination, region; if there are still no results
             # after applying them, remove location filter completely
             # TODO: don't do this if you already got the object from 'findMatch'
@@ -575,10 +736,14 @@ def multipleResultsAnalyzer(index, text):
     # (we assume location follows a preposition: "arhitektura na gorenjskem");
     # in case there is more than one preposition, we take index of the last one
     locationIndex = -1
+    nearBy = False                              # user wants things near them ("v bližini")
     for i, token in enumerate(sa(text, removestops=False)):
         if token.stopped == True:
             if locationIndex == -1:
                 locationIndex = i
+            # 'bližini' and 'blizu' are prepositions as well
+            if token.text in nearByList:
+                nearBy = True
         else:
             analyzedText.append(token.text)
 
@@ -630,6 +795,7 @@ def multipleResultsAnalyzer(index, text):
 
                     elif len(suggestionNearBy) > 0:
                         noFilter = True
+                        nearBy = True
                         break
 
                 if not noFilter:
@@ -708,7 +874,7 @@ def multipleResultsAnalyzer(index, text):
         print(text)
 
         print('\n')
-        return text, gotlocation, allowLocation, allowType, correctedLocation, globalFilter
+        return text, gotlocation, allowLocation, allowType, correctedLocation, globalFilter, nearBy
 
 
 def joinTerms(type, list):
@@ -833,15 +999,15 @@ def setDefaultLocationFilter(location, field):
 
 
 
-# only run once, to build index
+# only run once, to build index (from DB, or from a snapshot made with snapshot.py)
 #init()
+#init('snapshot.npz')
 
 # testing search
 #index = open_dir("../index")
 
-# get slovenian towns from file
-with open('../kraji_slovenija', 'rb') as fp:
-    townsStatic = pickle.load(fp)
+# get slovenian towns from file (gazetteer, memory mapped: 'word in townsStatic' and suggestions use binary search)
+townsStatic = gazetteer.load()
 
 
 #results = analyzeQuery(index, 'seznam rek ob morju')
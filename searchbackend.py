@@ -0,0 +1,406 @@
+import collections
+import re
+import Levenshtein
+import numpy
+from whoosh.analysis import StandardAnalyzer
+from whoosh.qparser import MultifieldParser, OrGroup
+from whoosh import query as whooshQuery
+import spatial
+
+
+# search backends for search.py
+# - WhooshBackend: Whoosh index in files (built by search.init(), has to be copied to every web node)
+# - PostgresBackend: full-text search straight on tables from models.py (tsvector columns with GIN indexes, pg_trgm
+#   for corrections of words), web nodes only need a connection to DB; setup() prepares DB for it
+# search.py talks to both the same way: queries and filters are Whoosh query objects (parsed with search.attrSchema),
+# corrections go through searcher().corrector(field).suggest() and searcher().correct_query()
+# a backend has:
+#   schema, searcher()                          (same as Whoosh index)
+#   search(text, limit, filterQuery, near)      best hits for text (near = (lat, lon, km): only items that close)
+#   nearest(lat, lon, limit, km)                closest items, without text
+#   position(location)                          (lat, lon) of a town name or of (gpsX, gpsY), None if not known
+#   topResultScore                              hits that are top results need a bigger score than that
+
+# one hit: stored fields (as in Whoosh index), score, coordinates (NaN if there are none)
+Hit = collections.namedtuple('Hit', ['fields', 'score', 'lat', 'lon'])
+
+# fields searched for text
+textFields = ["name", "type", "regionName", "description", "tags", "topResult", "destination", "place"]
+
+
+
+def get(index):
+
+    # backend for a Whoosh index (or the backend itself)
+
+    if isinstance(index, (WhooshBackend, PostgresBackend)):
+        return index
+
+    return WhooshBackend(index)
+
+
+
+class WhooshBackend(object):
+
+    topResultScore = 0.5
+
+    def __init__(self, index):
+        self.index = index
+        self.schema = index.schema
+        self.spatialIndex = spatial.forIndex(index)
+
+
+    def searcher(self):
+        return self.index.searcher()
+
+
+    def search(self, text, limit, filterQuery=None, near=None):
+        with self.index.searcher() as searcher:
+
+            # only docs near (lat, lon), together with filterQuery
+            if near is not None and self.spatialIndex is not None:
+                nearDocs = self.spatialIndex.nearbyDocs(*near)
+                if filterQuery is not None:
+                    nearDocs = nearDocs & set(searcher.docs_for_query(filterQuery))
+                # (empty filter would mean no filter for Whoosh)
+                if len(nearDocs) == 0:
+                    return []
+                filterQuery = nearDocs
+
+            # in case of multiple words in query, use OR (query: 'lake bled' => 'lake' OR 'bled')
+            # boost score of items that contain both tokens
+            orGroup = OrGroup.factory(0.9)
+            query = MultifieldParser(textFields, self.schema, group=orGroup).parse(text)
+            results = searcher.search(query, limit=limit, filter=filterQuery)
+
+            docnums = [results.docnum(i) for i in range(results.scored_length())]
+            lat, lon = self.coordinates(docnums)
+
+            return [Hit(results[i].fields(), results.score(i), lat[i], lon[i]) for i in range(len(docnums))]
+
+
+    def coordinates(self, docnums):
+        if self.spatialIndex is None:
+            return numpy.full(len(docnums), numpy.nan), numpy.full(len(docnums), numpy.nan)
+
+        return self.spatialIndex.coordinates(numpy.array(docnums, dtype=numpy.int64))
+
+
+    def nearest(self, lat, lon, limit, km):
+        if self.spatialIndex is None:
+            return []
+
+        positions, distances = self.spatialIndex.nearest(lat, lon, limit, km)
+
+        hits = []
+        with self.index.searcher() as searcher:
+            for i in positions:
+                docnum = self.spatialIndex.docnums[i]
+                if docnum >= 0:
+                    hits.append(Hit(searcher.stored_fields(int(docnum)), 0, self.spatialIndex.lat[i], self.spatialIndex.lon[i]))
+
+        return hits
+
+
+    def position(self, location):
+        if self.spatialIndex is None:
+            return None
+
+        return self.spatialIndex.position(location)
+
+
+
+# Postgres
+
+# items of all three tables, with the same fields as in Whoosh index (regions don't have all of them)
+itemsSql = '''(
+    SELECT 'attraction' AS "typeID", id, name, link, type, "regionName", destination, place, description, webpage,
+           tags, "topResult", "gpsX", "gpsY", "searchVector" FROM attraction
+    UNION ALL
+    SELECT 'town', id, name, link, type, "regionName", destination, place, description, webpage,
+           tags, "topResult", "gpsX", "gpsY", "searchVector" FROM town
+    UNION ALL
+    SELECT 'region', id, name, link, 'regije', name, '', '', description, '', '', FALSE, -1, -1, "searchVector"
+           FROM region
+) AS item'''
+
+itemColumns = ['typeID', 'id', 'name', 'link', 'type', 'regionName', 'destination', 'place', 'description',
+               'webpage', 'tags', 'topResult', 'gpsX', 'gpsY']
+
+# weights of fields in searchVector (like field boosts in Whoosh schema): SQL expressions on the new row
+vectorFields = {
+    'attraction': [('NEW.name', 'A'), ('NEW.type', 'B'), ('NEW.tags', 'C'), ('NEW."regionName"', 'C'),
+                   ('NEW.destination', 'C'), ('NEW.place', 'C'), ('NEW.description', 'D')],
+    'town': [('NEW.name', 'A'), ('NEW.type', 'B'), ('NEW.tags', 'C'), ('NEW."regionName"', 'C'),
+             ('NEW.destination', 'C'), ('NEW.place', 'C'), ('NEW.description', 'D')],
+    'region': [('NEW.name', 'A'), ("'regije'", 'B'), ('NEW.description', 'D')],
+}
+# ts_rank weights of D, C, B, A (description 0.01, type 1.2 / 1.5 and other fields 1 / 1.5 of name)
+rankWeights = '{0.01, 0.67, 0.8, 1.0}'
+
+# words of these fields can be corrected (searcher().corrector(field)), they are kept in table search_word
+correctorFields = ['name', 'type', 'regionName', 'destination', 'place']
+
+# distance in km between item and (lat, lon), equirectangular like in spatial.py
+distanceSql = ('%f * sqrt(power(radians(item."gpsY" - %%s) * cos(radians((item."gpsX" + %%s) / 2)), 2) + '
+               'power(radians(item."gpsX" - %%s), 2))' % spatial.earthRadius)
+
+
+
+def setup(db):
+
+    # prepare DB for PostgresBackend (can be run again): pg_trgm, searchVector columns with GIN indexes and triggers
+    # that keep them up to date, table search_word with words for corrections
+    # after a crawl, run refreshWords() (new words for corrections)
+
+    db.execute_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table, fields in vectorFields.items():
+        if 'searchVector' not in [column.name for column in db.get_columns(table)]:
+            db.execute_sql('ALTER TABLE %s ADD COLUMN "searchVector" tsvector' % table)
+
+        vector = ' || '.join("setweight(to_tsvector('simple', coalesce(%s, '')), '%s')" % field for field in fields)
+        db.execute_sql('CREATE OR REPLACE FUNCTION %s_search_vector() RETURNS trigger AS $$ BEGIN '
+                       'NEW."searchVector" := %s; RETURN NEW; END $$ LANGUAGE plpgsql' % (table, vector))
+        db.execute_sql('DROP TRIGGER IF EXISTS %s_search_vector ON %s' % (table, table))
+        db.execute_sql('CREATE TRIGGER %s_search_vector BEFORE INSERT OR UPDATE ON %s FOR EACH ROW '
+                       'EXECUTE PROCEDURE %s_search_vector()' % (table, table, table))
+
+        # fill vectors of rows that are already there (trigger does it)
+        db.execute_sql('UPDATE %s SET "searchVector" = NULL WHERE "searchVector" IS NULL' % table)
+        db.execute_sql('CREATE INDEX IF NOT EXISTS %s_search_vector ON %s USING GIN ("searchVector")' % (table, table))
+
+    db.execute_sql('CREATE TABLE IF NOT EXISTS search_word (field VARCHAR(32), word VARCHAR(255), '
+                   'PRIMARY KEY (field, word))')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS search_word_trgm ON search_word USING GIN (word gin_trgm_ops)')
+    refreshWords(db)
+
+    return
+
+
+
+def refreshWords(db):
+
+    # all words of correctorFields (tokens, like terms in Whoosh index), run it after a crawl
+
+    with db.atomic():
+        db.execute_sql('DELETE FROM search_word')
+        for field in correctorFields:
+            documents = 'SELECT to_tsvector(\'simple\', coalesce(item."%s", \'\')) FROM %s' % (field, itemsSql)
+            db.execute_sql('INSERT INTO search_word (field, word) SELECT %s, word FROM ts_stat(%s)',
+                           (field, documents))
+
+    return
+
+
+
+class PostgresCorrector(object):
+
+    # suggestions for a word from words of a field: candidates by prefix or trigram similarity (pg_trgm), then
+    # the ones within maxdist (Levenshtein), closest first (like whoosh corrector)
+
+    def __init__(self, db, field):
+        self.db = db
+        self.field = field
+
+
+    def suggest(self, text, limit=5, maxdist=2, prefix=0):
+        text = text.lower()
+        sql = 'SELECT word FROM search_word WHERE field = %s AND length(word) BETWEEN %s AND %s'
+        params = [self.field, len(text) - maxdist, len(text) + maxdist]
+        if prefix > 0:
+            sql += ' AND word LIKE %s'
+            params.append(text[:prefix].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        else:
+            sql += ' AND word %% %s'
+            params.append(text)
+        sql += ' ORDER BY similarity(word, %s) DESC LIMIT 200'
+        params.append(text)
+
+        found = []
+        for word, in self.db.execute_sql(sql, params):
+            distance = Levenshtein.distance(text, word)
+            if distance <= maxdist:
+                found.append((distance, word))
+
+        return [word for distance, word in sorted(found)[:limit]]
+
+
+    def exists(self, word):
+        return self.db.execute_sql('SELECT 1 FROM search_word WHERE field = %s AND word = %s',
+                                   (self.field, word.lower())).fetchone() is not None
+
+
+
+# result of correct_query, like whoosh.spelling.Correction
+Correction = collections.namedtuple('Correction', ['query', 'string'])
+
+
+
+class PostgresSearcher(object):
+
+    # what search.py needs from a Whoosh searcher
+
+    def __init__(self, db):
+        self.db = db
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+
+    def corrector(self, field):
+        return PostgresCorrector(self.db, field)
+
+
+    def correct_query(self, q, qstring, maxdist=2, prefix=0):
+
+        # correct words of query that are not in their field (like Whoosh does)
+
+        corrected = q
+        string = qstring
+        for field, word in q.all_terms():
+            if field not in correctorFields or not isinstance(word, str):
+                continue
+            corrector = self.corrector(field)
+            if corrector.exists(word):
+                continue
+            suggestions = corrector.suggest(word, limit=1, maxdist=maxdist, prefix=prefix)
+            if len(suggestions) > 0:
+                corrected = corrected.replace(field, word, suggestions[0])
+                string = re.sub(r'\b%s\b' % re.escape(word), suggestions[0], string, flags=re.IGNORECASE)
+
+        return Correction(corrected, string)
+
+
+
+class PostgresBackend(object):
+
+    topResultScore = 0
+
+    def __init__(self, db=None, schema=None):
+        import models
+        import search
+        self.db = db or models.connectDB()
+        self.schema = schema or search.attrSchema
+        self.analyzer = StandardAnalyzer(stoplist=None)
+
+
+    def searcher(self):
+        return PostgresSearcher(self.db)
+
+
+    def words(self, text):
+        return [token.text for token in self.analyzer(text)]
+
+
+    def filterSql(self, q, params):
+
+        # Whoosh query object (Term, And, Or, ... as made by search.py) -> SQL condition on item
+
+        if q is None or isinstance(q, whooshQuery.Every):
+            return 'TRUE'
+        if q is whooshQuery.NullQuery:
+            return 'FALSE'
+        if isinstance(q, whooshQuery.And):
+            return '(' + ' AND '.join(self.filterSql(sub, params) for sub in q.subqueries) + ')'
+        if isinstance(q, whooshQuery.Or):
+            return '(' + ' OR '.join(self.filterSql(sub, params) for sub in q.subqueries) + ')'
+        if isinstance(q, whooshQuery.Not):
+            return '(NOT ' + self.filterSql(q.query, params) + ')'
+
+        if isinstance(q, whooshQuery.Term):
+            if q.fieldname == 'topResult':
+                params.append(str(q.text).lower() in ('true', 'yes', '1', 't'))
+                return 'item."topResult" = %s'
+            if q.fieldname in ('id', 'typeID', 'link', 'webpage'):
+                params.append(str(q.text))
+                return 'item."%s"::text = %%s' % q.fieldname
+            params.append(str(q.text))
+            return 'to_tsvector(\'simple\', coalesce(item."%s", \'\')) @@ plainto_tsquery(\'simple\', %%s)' % q.fieldname
+
+        if isinstance(q, whooshQuery.Phrase):
+            params.append(' '.join(q.words))
+            return 'to_tsvector(\'simple\', coalesce(item."%s", \'\')) @@ plainto_tsquery(\'simple\', %%s)' % q.fieldname
+
+        if isinstance(q, whooshQuery.Prefix):
+            params.append(str(q.text).lower() + '%')
+            return 'lower(item."%s") LIKE %%s' % q.fieldname
+
+        print('WARNING: filter not supported by PostgresBackend, ignoring it:', q)
+        return 'TRUE'
+
+
+    def nearSql(self, near, params):
+        lat, lon, km = near
+        params.extend([lat - km / spatial.kmPerDegree, lat + km / spatial.kmPerDegree, lon, lat, lat, km])
+        return ('item."gpsX" BETWEEN %%s AND %%s AND item."gpsX" <> -1 AND %s <= %%s' % distanceSql)
+
+
+    def rows(self, sql, params, score=True):
+        hits = []
+        for row in self.db.execute_sql(sql, params):
+            fields = dict(zip(itemColumns, row))
+            fields['id'] = str(fields['id'])
+            lat = fields.pop('gpsX')
+            lon = fields.pop('gpsY')
+            hasGps = lat is not None and lat != -1 and lon != -1
+            hits.append(Hit(fields, float(row[-1]) if score else 0, lat if hasGps else numpy.nan,
+                            lon if hasGps else numpy.nan))
+
+        return hits
+
+
+    def search(self, text, limit, filterQuery=None, near=None):
+
+        # words are joined with OR, hits with more of them get a bigger rank (ts_rank, weights of fields)
+
+        words = self.words(text)
+        if len(words) == 0:
+            return []
+
+        params = [' | '.join("'%s'" % word.replace("'", "''") for word in words)]
+        conditions = ['item."searchVector" @@ q', self.filterSql(filterQuery, params)]
+        if near is not None:
+            conditions.append(self.nearSql(near, params))
+        params.append(limit)
+
+        columns = ', '.join('item."%s"' % column for column in itemColumns)
+        sql = ('SELECT %s, ts_rank(\'%s\'::float4[], item."searchVector", q) AS rank FROM %s, to_tsquery(\'simple\', %%s) AS q '
+               'WHERE %s ORDER BY rank DESC, item.id LIMIT %%s' % (columns, rankWeights, itemsSql, ' AND '.join(conditions)))
+
+        return self.rows(sql, params)
+
+
+    def nearest(self, lat, lon, limit, km):
+        params = []
+        condition = self.nearSql((lat, lon, km), params)
+        params.extend([lon, lat, lat, limit])
+
+        columns = ', '.join('item."%s"' % column for column in itemColumns)
+        sql = 'SELECT %s, 0 FROM %s WHERE %s ORDER BY %s LIMIT %%s' % (columns, itemsSql, condition, distanceSql)
+
+        return self.rows(sql, params, score=False)
+
+
+    def position(self, location):
+        if isinstance(location, (tuple, list)) and len(location) == 2:
+            return float(location[0]), float(location[1])
+        if not isinstance(location, str):
+            return None
+
+        row = self.db.execute_sql('SELECT "gpsX", "gpsY" FROM town WHERE lower(name) = %s AND "gpsX" <> -1 LIMIT 1',
+                                  (location.lower(),)).fetchone()
+
+        return (row[0], row[1]) if row else None
+
+
+
+# prepare DB for PostgresBackend (once, and refreshWords() after every crawl)
+if __name__ == '__main__':
+    import models
+    setup(models.connectDB())
@@ -1,55 +1,138 @@
 from lxml import html, etree
-import requests
 import time
 from models import *
 from playhouse.shortcuts import model_to_dict
+from fetcher import getPage
+from extract import baseUrl, baseUrlPictures, attractionExtract, townExtract, fixLinks, descriptionText, compressHtml, decompressHtml
+import store
+import recrawl
+import metrics
+import itemcache
 
 
 # getting data from webpage www.slovenia.info using lxml and Xpath
 # using ORM 'peewee': http://docs.peewee-orm.com/en/latest/index.html
 # postgreSQL database
 
-baseUrl = "http://www.slovenia.info"
-baseUrlPictures = "http://www.slovenia.info/"
-topResults = []
-
-regionLog = None
-attrLog = None
-townLog = None
+# seconds to wait between requests (serial version)
+delay = .300
 
 # select language: 1 = SLO, 2 = English, 3 = Deutsch, 4 = Italiano, 5 = Français, 6 = Pусский, 7 = Español
 lng = 1
 
+# Gorenjska, Goriška, Obalno - kraška, Osrednjeslovenska, Podravska, Notranjsko - kraška, Jugovzhodna Slovenija, Koroška, Savinjska, Pomurska, Spodnjeposavska, Zasavska
+# without lng param in url, we add it later
+regions = [
+    'http://www.slovenia.info/si/Regije/Gorenjska.htm?_ctg_regije=10&lng=',
+    'http://www.slovenia.info/si/Regije/Gori%C5%A1ka-Smaragdna-pot.htm?_ctg_regije=9&lng=',
+    'http://www.slovenia.info/si/Regije/Obalno-kra%C5%A1ka.htm?_ctg_regije=17&lng=',
+    'http://www.slovenia.info/si/Regije/Osrednjeslovenska.htm?_ctg_regije=11&lng=',
+    'http://www.slovenia.info/si/Regije/Podravska.htm?_ctg_regije=15&lng=',
+    'http://www.slovenia.info/si/Regije/Notranjsko-kra%C5%A1ka.htm?_ctg_regije=134&lng=',
+    'http://www.slovenia.info/si/Regije/Jugovzhodna-Slovenija.htm?_ctg_regije=13&lng=',
+    'http://www.slovenia.info/si/Regije/Koro%C5%A1ka.htm?_ctg_regije=121&lng=',
+    'http://www.slovenia.info/si/Regije/Savinjska.htm?_ctg_regije=14&lng=',
+    'http://www.slovenia.info/si/Regije/Pomurska.htm?_ctg_regije=16&lng=',
+    'http://www.slovenia.info/si/Regije/Spodnjeposavska.htm?_ctg_regije=133&lng=',
+    'http://www.slovenia.info/si/Regije/Zasavska.htm?_ctg_regije=12&lng='
+]
+
+# one page that contains links of all the cities and places, also without lng param
+townsUrl = 'http://www.slovenia.info/si/Mesta-in-kraji.htm?_ctg_kraji=0&lng='
+
+
+
+class CrawlContext(object):
+
+    # state of one crawl, passed to all functions that need it (so more regions can be crawled at the same time):
+    # log files, ids of top results of the list we are looking at and ids of attractions/towns we already got
+    # (id = part of url after the last '/', we cannot compare full urls, they are different on different lists)
+
+    def __init__(self, regionLog=None, attrLog=None, townLog=None, seenIDs=None):
+        self.logs = {'region': regionLog, 'attraction': attrLog, 'town': townLog}
+        self.topIDs = set()
+        self.seenIDs = set() if seenIDs is None else seenIDs
+
+
+    def forList(self):
+
+        # context for one list of attractions/towns: the same logs and seen items, its own top results
+
+        return CrawlContext(self.logs['region'], self.logs['attraction'], self.logs['town'], self.seenIDs)
+
+
+    def setTopResults(self, links):
+        self.topIDs = set(linkID(link) for link in links)
+
+
+    def isTopResult(self, url):
+        return linkID(url) in self.topIDs
+
+
+    def logError(self, kind, url, e, stage='crawl'):
+
+        # kind = region, attraction or town; stage = where it failed (for metrics)
+
+        metrics.count('errors_total', stage=stage, kind=kind)
+        log = self.logs[kind]
+        if log is not None:
+            log.write("ERROR: " + url + ' : ' + str(e) + '\n')
+
+        return
+
+
+
+def linkID(url):
+    return url.split('/')[-1]
+
 
 
 def prepareLogFiles():
-    global regionLog, attrLog, townLog
 
-    # log files
+    # log files, returns context for a new crawl that writes to them
     regionLog = open('log_files/region_errors.log', 'w')
     attrLog = open('log_files/attr_errors.log', 'w')
     townLog = open('log_files/town_errors.log', 'w')
 
-    return
+    return CrawlContext(regionLog, attrLog, townLog)
+
+
+
+# item types (in urls and API) and their models
+itemModels = {'region': Region, 'town': Town, 'attraction': Attraction}
+
+
+
+def itemDict(item):
+
+    # item from DB as dict, ready for templates and JSON
+
+    item = model_to_dict(item, recurse=False)
+    item['timestamp'] = str(item['timestamp'])
+
+    # description is shown as HTML
+    item['description'] = decompressHtml(item.pop('descriptionHtml')) or item['description']
+
+    return item
+
+
+
+# items read from DB are cached (itemcache.py), they change only when the crawler writes them
+cache = itemcache.ItemCache(itemModels, itemDict)
 
 
 
 def getFromDB(type, id):
 
-    # get item from DB based on id and type
+    # get item from DB (or cache) based on id and type
 
     item = None
     try:
-        if type == 'region':
-            item = Region.get(Region.id == id)
-        elif type == 'town':
-            item = Town.get(Town.id == id)
-        elif type == 'attraction':
-            item = Attraction.get(Attraction.id == id)
-
-        item = model_to_dict(item, recurse=False)
-        item['timestamp'] = str(item['timestamp'])
-        print('Getting item from DB:', item['name'])
+        item = cache.get(type, id)
+        if item is None:
+            print('ERROR: No such item:', type, id)
+        else:
+            print('Getting item from DB:', item['name'])
 
     except Exception as e:
         print('ERROR:', e)
@@ -58,6 +141,18 @@ def getFromDB(type, id):
 
 
 
+def getManyFromDB(items):
+
+    # get more items from DB (or cache) with one query per type; items = list of (type, id)
+    # returns items in the same order (None for unknown types and ids)
+
+    found = cache.getMany(items)
+    print('Getting', len(items) - found.count(None), 'of', len(items), 'items from DB')
+
+    return found
+
+
+
 def getRegion(name):
 
     # find Region by name in db
@@ -88,118 +183,120 @@ def getAttraction(link):
 
 
 
-def addTowns():
+def addTowns(context):
 
     # one page that contains links of all the cities and places
     # added lng param so we can simply choose lng
-    towns = 'http://www.slovenia.info/si/Mesta-in-kraji.htm?_ctg_kraji=0&lng=' + str(lng)
-    pageGetLinks(towns, None)
-
+    # (serial version, for a full crawl use 'crawler.py')
+    pageGetLinks(townsUrl + str(lng), None, context)
+    store.flushAll()
+    metrics.write()
 
 
-def selectRegion():
 
-    # Gorenjska, Goriška, Obalno - kraška, Osrednjeslovenska, Podravska, Notranjsko - kraška, Jugovzhodna Slovenija, Koroška, Savinjska, Pomurska, Spodnjeposavska, Zasavska
-    # without lng param in url, we add it later
-
-    regions = [
-        'http://www.slovenia.info/si/Regije/Gorenjska.htm?_ctg_regije=10&lng=',
-        'http://www.slovenia.info/si/Regije/Gori%C5%A1ka-Smaragdna-pot.htm?_ctg_regije=9&lng=',
-        'http://www.slovenia.info/si/Regije/Obalno-kra%C5%A1ka.htm?_ctg_regije=17&lng=',
-        'http://www.slovenia.info/si/Regije/Osrednjeslovenska.htm?_ctg_regije=11&lng=',
-        'http://www.slovenia.info/si/Regije/Podravska.htm?_ctg_regije=15&lng=',
-        'http://www.slovenia.info/si/Regije/Notranjsko-kra%C5%A1ka.htm?_ctg_regije=134&lng=',
-        'http://www.slovenia.info/si/Regije/Jugovzhodna-Slovenija.htm?_ctg_regije=13&lng=',
-        'http://www.slovenia.info/si/Regije/Koro%C5%A1ka.htm?_ctg_regije=121&lng=',
-        'http://www.slovenia.info/si/Regije/Savinjska.htm?_ctg_regije=14&lng=',
-        'http://www.slovenia.info/si/Regije/Pomurska.htm?_ctg_regije=16&lng=',
-        'http://www.slovenia.info/si/Regije/Spodnjeposavska.htm?_ctg_regije=133&lng=',
-        'http://www.slovenia.info/si/Regije/Zasavska.htm?_ctg_regije=12&lng='
-    ]
+def selectRegion(context):
 
+    # serial version, for a full crawl use 'crawler.py'
     for region in regions:
-        # wait 0.3 sec
-        time.sleep(.300)
+        # wait 0.3 sec (delay)
+        time.sleep(delay)
         # adding lng param
         region = region + str(lng)
-        regionGetData(region)
+        regionGetData(region, context)
+
+    store.flushAll()
+    metrics.write()
 
     return
 
 
 
-def regionGetData(regionUrl):
+def regionGetData(regionUrl, context):
 
     # get data from individual region
     #print('region:', regionUrl)
-    
+
+    name = None
     try:
-        page = requests.get(regionUrl)
-        elTree = etree.HTML(page.text)
+        page = getPage(regionUrl)
+        newRegion, attrLinks = regionParseData(regionUrl, page)
+        name = newRegion['name']
 
-        # name
-        name = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[1]/div[2]/h1/text()')
-        print('region name:', name)
+        #saving to db
+        regionId = store.saveRegion(newRegion)
 
-        # description
-        description = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]')
+        # let's get attractions from attraction link
+        pageGetLinks(attrLinks, regionId, context)
 
-        # find all relative links in description and replace them with absolute ones
-        descriptionFixed = fixLinks(description[0])
+    except Exception as e:
+        print('ERROR:', e)
+        context.logError('region', regionUrl, e)
 
-        description = etree.tostring(descriptionFixed)
-        #print('data:', description)
+    print('FINISHED WITH REGION', name, '\n---------------------------------------------\n')
 
-        # picture link
-        pictureLink = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/a/img/@src')
-        if len(pictureLink) > 0:
-            pictureLink = baseUrlPictures + pictureLink[0]
-        #print('link to picture:', pictureLink)
+    return
 
-        # attractions link
-        attrLinks = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[1]/div[4]/a[4]/@href')
-        if len(attrLinks) > 0:
-            attrLinks = attrLinks[0]
-        #print('attractions:', attrLinks)
-        #print('----------------------------------------\n')
 
-        #saving to db
-        if Region.select().where(Region.name == name[0]).exists():
-            newRegion = Region(name = name[0], link = regionUrl, description = description, picture = pictureLink)
-            newRegion.save()
 
-            # let's get attractions from attraction link
-            pageGetLinks(attrLinks, newRegion)
+def regionParseData(regionUrl, page):
 
-    except Exception as e:
-        print('ERROR:', e)
-        regionLog.write("ERROR: " + regionUrl + ' : ' + str(e) + '\n')
+    # parse region page, returns new region (row for DB) and link to its attractions
 
-    print('FINISHED WITH REGION', name, '\n---------------------------------------------\n')
+    start = time.monotonic()
+    elTree = etree.HTML(page.text)
 
-    return
+    # name
+    name = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[1]/div[2]/h1/text()')
+    print('region name:', name)
 
+    # description
+    description = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]')
 
+    # find all relative links in description and replace them with absolute ones
+    descriptionFixed = fixLinks(description[0])
 
-def pageGetLinks(pageUrl, regionObject):
+    # plain text for search, compressed HTML for showing it
+    description = descriptionText(descriptionFixed)
+    descriptionHtml = compressHtml(etree.tostring(descriptionFixed))
+    #print('data:', description)
 
-    # get attraction links from [ Home -> Regions -> Some region -> Attractions ] page OR [ Home -> Towns ] page
+    # picture link
+    pictureLink = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/a/img/@src')
+    if len(pictureLink) > 0:
+        pictureLink = baseUrlPictures + pictureLink[0]
+    else:
+        pictureLink = ''
+    #print('link to picture:', pictureLink)
 
-    page = requests.get(pageUrl)
-    tree = html.fromstring(page.content)
+    # attractions link
+    attrLinks = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[1]/div[4]/a[4]/@href')
+    if len(attrLinks) > 0:
+        attrLinks = attrLinks[0]
+    #print('attractions:', attrLinks)
+    #print('----------------------------------------\n')
 
-    # finds those div-s that are named "resultsBox..", they contain links of attractions (sorted by type: churches, lakes, rivers,..)
-    regexpNS = "http://exslt.org/regular-expressions"
-    attrGroups = tree.xpath('//*[@id="tdMainCenter"]//div[re:test(@id, "^resultsBox")]', namespaces={'re': regexpNS})
-    print('num of groups:', len(attrGroups))
+    newRegion = {'name': name[0], 'link': regionUrl, 'description': description, 'descriptionHtml': descriptionHtml, 'picture': pictureLink}
+    metrics.observe('parse_seconds', time.monotonic() - start, kind='region')
+
+    return newRegion, attrLinks
+
+
+
+def pageGetLinks(pageUrl, regionObject, context):
+
+    # get attraction links from [ Home -> Regions -> Some region -> Attractions ] page OR [ Home -> Towns ] page
+
+    context = context.forList()
+    page = getPage(pageUrl)
+    attrGroups = pageParseGroups(page)
 
     # we pass on whole tree element so we can extract links (root is div named resultsBox; it contains all links of attractions)
     n = 1
     for node in attrGroups:
         #print(n, ":", node.tag, node.attrib['id'])
-        attrLinksList = attractionGroup(node, n)
+        attrLinksList = attractionGroup(node, n, context)
         print('Starting with group', n, '- number of items:', len(attrLinksList))
-        pageAllLinks(attrLinksList, regionObject)
+        pageAllLinks(attrLinksList, regionObject, context)
         print('Finished with group', n, '\n---------------------------------------------------------\n')
         n += 1
 
@@ -207,16 +304,47 @@ def pageGetLinks(pageUrl, regionObject):
 
 
 
-def attractionGroup(group, n):
-    global topResults
+def pageParseGroups(page):
+
+    # finds those div-s that are named "resultsBox..", they contain links of attractions (sorted by type: churches, lakes, rivers,..)
+
+    with metrics.timer('parse_seconds', kind='list'):
+        tree = html.fromstring(page.content)
+        regexpNS = "http://exslt.org/regular-expressions"
+        attrGroups = tree.xpath('//*[@id="tdMainCenter"]//div[re:test(@id, "^resultsBox")]', namespaces={'re': regexpNS})
+    print('num of groups:', len(attrGroups))
+
+    return attrGroups
+
+
+
+def attractionGroup(group, n, context):
+
+    # get all attraction links for specific group (lakes, rivers,...), including the ones on other pages of the group
+
+    attrLinksList, subPageLinks, groupId = attractionGroupLinks(group, n, context)
+
+    for pageLink in subPageLinks:
+        # wait 0.3 sec (delay)
+        time.sleep(delay)
+
+        # adding links from page 2, 3, .. of selected group
+        attractionsPage = attrGroupSubPage(pageLink, groupId)
+        attrLinksList.extend(attractionsPage)
+        #print('number of attractions in group:', len(attrLinksList))
+
+    return attrLinksList
+
+
 
-    # get all attraction links for specific group (lakes, rivers,...)
+def attractionGroupLinks(group, n, context):
 
-    # save links of the top results (n = 1, group 1 is top results) to array, so we can access it later;
+    # get attraction links from the first page of a group and links to its other pages (without loading them)
+
+    # save ids of the top results (n = 1, group 1 is top results) to context, so we can access it later;
     if n == 1:
-        topResults = group.xpath('//div[@class="info"]/a[1]/@href')
-        #print('adding TOP link:', topResults)
-        #print('No:', len(topResults))
+        context.setTopResults(group.xpath('//div[@class="info"]/a[1]/@href'))
+        #print('No:', len(context.topIDs))
 
     # first we get all the attraction links from page one (default)
     attrLinksList = []
@@ -234,22 +362,17 @@ def attractionGroup(group, n):
 
     # we look for the links of pages (if there are more than 50 attractions in a group, they are paginated)
     # we don't need to 'click' on the first link (we already have those attractions, they are shown by default)
+    subPageLinks = []
     count = 0
     for pageLinks in group.iterfind('div[@class="subbox"]/div[@class="paging"]/div[@class="links"]/a'):
         #print("Page link found:", pageLinks.tag, pageLinks.attrib['href'])
 
         if count != 0:
-            # wait 0.3 sec
-            time.sleep(.300)
-
-            # adding links from page 2, 3, .. of selected group
-            attractionsPage = attrGroupSubPage(pageLinks.attrib['href'], groupId)
-            attrLinksList.extend(attractionsPage)
-            #print('number of attractions in group:', len(attrLinksList))
+            subPageLinks.append(pageLinks.attrib['href'])
 
         count += 1
 
-    return attrLinksList
+    return attrLinksList, subPageLinks, groupId
 
 
 
@@ -260,7 +383,17 @@ def attrGroupSubPage(link, id):
     fullLink = baseUrl + link
     #print("going to page:", fullLink)
 
-    page = requests.get(fullLink)
+    page = getPage(fullLink)
+
+    return attrGroupSubPageParse(page, id)
+
+
+
+def attrGroupSubPageParse(page, id):
+
+    # extract links of attractions from the div with given id
+
+    start = time.monotonic()
     tree = html.fromstring(page.content)
 
     # search string
@@ -268,6 +401,7 @@ def attrGroupSubPage(link, id):
     #print(searchStr)
 
     linksPageAttractions = tree.xpath(searchStr)
+    metrics.observe('parse_seconds', time.monotonic() - start, kind='list')
     #print('new links:', linksPageAttractions)
     #print('number of new links:', len(linksPageAttractions))
 
@@ -275,411 +409,141 @@ def attrGroupSubPage(link, id):
 
 
 
-def pageAllLinks(links, regionObject):
+def pageAllLinks(links, regionObject, context):
 
     # now we have links of all the attractions of specific region, lets go through them and get data out
 
     n = 1
     for link in links:
         fullLink = baseUrl + link
-        time.sleep(.300)
+
+        # skip it if we already got it from some other list (a page that failed is tried again from the next list)
+        # seen ids are kept only for this crawl; in the next one, recrawl.py skips pages that didn't change
+        if linkID(link) in context.seenIDs:
+            n += 1
+            continue
+
+        time.sleep(delay)
 
         # use regionObject as an identifier between attraction/town type (town has regionObject 'None', all attractions have valid regionObject (not None))
         if regionObject == None:
-            townGetData(fullLink, n, len(links))
+            done = townGetData(fullLink, n, len(links), context)
         else:
-            attractionGetData(fullLink, regionObject, n, len(links))
+            done = attractionGetData(fullLink, regionObject, n, len(links), context)
+        if done:
+            context.seenIDs.add(linkID(link))
         n += 1
 
     return
 
 
 
-def attractionGetData(attractionUrl, regionObject, n, numLinks):
-    global topResults
+def attractionGetData(attractionUrl, regionObject, n, numLinks, context):
 
-    # get data from individual attraction
+    # get data from individual attraction, returns False if it failed
     # print('link:', attractionUrl)
 
     try:
-        page = requests.get(attractionUrl)
-        tree = html.fromstring(page.content)
-        elTree = etree.HTML(page.text)
-
-        # name of the attraction:
-        attractionName = tree.xpath('// *[ @ id = "tdMainCenter"] / div[3] / div[1] / div[4] / h1/text()')
-        if len(attractionName) == 0:
-            attractionName = ['']
-
-        print(attractionName[0], '(', n, '/', numLinks, ')')
-
-        # address:
-        attractionAddress = tree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[1]/div[1]/div[@class="prop propLocation"]/div[2]/text()')
-        if len(attractionAddress) == 0:
-            attractionAddress = ['']
-        #print("address:", attractionAddress)
-
-        # phone:
-        attractionPhone = tree.xpath(
-            '//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[1]/div[1]/div[@class="prop propPhone"]/div[2]/text()')
-        if len(attractionPhone) == 0:
-            attractionPhone = ['']
-        #print("phone:", attractionPhone)
-
-        # email does not work, problem with js (link is not visible to lxml?)
-        attractionEmail = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[1]/div[1]/div[2]/div[2]')
-        #if len(attractionEmail) > 0:
-            #print("email:", etree.tostring(attractionEmail[0]))
-
-        # webpage:
-        attractionWebpage = tree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[1]/div[1]/div[@class="prop propRow propWWW"]/a/text()')
-
-        # in case link is split, we have to merge it
-        attractionWebpage = ''.join(attractionWebpage)
-        #print("webpage:", attractionWebpage)
-
-        # webpage path to attraction, we remove the first one as its always "Domov" and save the one before last as it tells as type of attraction
-        attractionNavPath = tree.xpath('//*[@id="tdMainCenter"]/div[1]//a/text()')
-        attractionType = attractionNavPath[len(attractionNavPath)-2]
-        attractionNavPath.pop(0)
-        attractionNavPath = ','.join(attractionNavPath)
-        #print("navigation path:", attractionNavPath)
-
-        # description:
-        attractionDescription = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]')
-        #print("raw:,", etree.tostring(attractionDescription[0]))
-
-        # we remove unecessary parts (we only need body text)
-        childDiv = attractionDescription[0].find('div')
-        #print('Odstranjujem:', etree.tostring(childDiv))
-        if childDiv is not None:
-            attractionDescription[0].remove(childDiv)
-
-        # if we try to remove picture link, we also remove text -> NOT OK! TO-DO: http://stackoverflow.com/questions/22967659/removing-an-element-but-not-the-text-after-it
-        # childLink = attractionDescription[0].find('a')
-        # print('Removing:', etree.tostring(childLink))
-        # attractionDescription[0].remove(childLink)
-
-        # find all relative links in description and replace them with absolute ones
-        attractionDescriptionFixed = fixLinks(attractionDescription[0])
-        content = etree.tostring(attractionDescriptionFixed)
-        #print("description:", content)
-
-        # main picture: (we have to merge it with base url for full picture url)
-        attractionPictureMain = tree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/a/img/@src')
-        if len(attractionPictureMain) > 0:
-            attractionPictureMain = baseUrlPictures + attractionPictureMain[0]
-        #print("link to main picture:", attractionPictureMain)
-
-        # region
-        attractionRegion = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row region"]/a/text()')
-        if len(attractionRegion) < 1:
-            attractionRegion = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row region"]/text()')
-            if len(attractionRegion) == 0:
-                attractionRegion = ['']
-        #print("region:", attractionRegion)
-
-        # destination
-        attractionDestination = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row destination"]/a/text()')
-        if len(attractionDestination) < 1:
-            attractionDestination = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row destination"]/text()')
-            if len(attractionDestination) == 0:
-                attractionDestination = ['']
-        #print("destination:", attractionDestination)
-
-        # place
-        attractionPlace = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row place"]/a/text()')
-        if len(attractionPlace) < 1:
-            attractionPlace = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row place"]/text()')
-            if len(attractionPlace) == 0:
-                attractionPlace = ['']
-        #print("place:", attractionPlace)
-
-        # GPS coordinates
-        attractionGPS = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row gps"]/a/text()')
-        if len(attractionGPS):
-            gpsX = float(attractionGPS[0].replace(',', '.'))
-            gpsY = float(attractionGPS[1].replace(',', '.'))
-        else:
-            gpsX = -1
-            gpsY = -1
-
-        #print("gps [x, y]:", attractionGPS)
-
-        # check if it's top result with array we saved in the beginning (by comparing the part of urls, after the last '/' - we cannot commpare full urls, they are different)
-        isTopResult = False
-        for link in topResults:
-            linkID = link.split('/')[-1]
-            townUrlID = attractionUrl.split('/')[-1]
-            if linkID == townUrlID:
-                isTopResult = True
-                break
-
-        #print('Top result:', isTopResult)
-
-        #print('------------------------------------------\n')
-
-        # saving to DB
-        if Attraction.select().where(Attraction.name == attractionName[0], Attraction.regionName == attractionRegion[0]).exists():
-            newAttr = Attraction(name = attractionName[0],
-                                 link = attractionUrl,
-                                 address = attractionAddress[0],
-                                 phone = attractionPhone[0],
-                                 webpage = attractionWebpage,
-                                 tags = attractionNavPath,
-                                 type = attractionType,
-                                 description = content,
-                                 picture = attractionPictureMain,
-                                 regionName = attractionRegion[0],
-                                 region = regionObject,
-                                 destination = attractionDestination[0],
-                                 place = attractionPlace[0],
-                                 gpsX = gpsX,
-                                 gpsY = gpsY,
-                                 topResult = isTopResult
-                                 )
-    
-            newAttr.save()
+        # conditional request, skip the page if it didn't change since the last crawl
+        isTop = context.isTopResult(attractionUrl)
+        page = getPage(attractionUrl, headers=recrawl.conditionalHeaders(attractionUrl, isTop))
+        if recrawl.isUnchanged(attractionUrl, page, isTop):
+            print('Unchanged:', attractionUrl, '(', n, '/', numLinks, ')')
+            return True
+
+        newAttr = attractionParseData(attractionUrl, page, regionObject, isTop)
+        print(newAttr['name'], '(', n, '/', numLinks, ')')
+
+        # saving to DB (in batches)
+        store.attractions.add(newAttr)
+        recrawl.remember(attractionUrl, page, isTop)
 
     except Exception as e:
         print('EXCEPTION: ', str(e))
-        attrLog.write("ERROR: " + attractionUrl + ' : ' + str(e) + '\n')
+        context.logError('attraction', attractionUrl, e)
+        return False
 
-    return
+    return True
+
+
+
+def attractionParseData(attractionUrl, page, regionObject, topResult):
+
+    # parse attraction page, returns new attraction (row for DB); regionObject is id of its region
+
+    with metrics.timer('parse_seconds', kind='attraction'):
+        data = attractionExtract(page.content)
+
+    return attractionRow(attractionUrl, data, regionObject, topResult)
 
 
 
-def townGetData(townUrl, n, numLinks):
-    global topResults
+def attractionRow(attractionUrl, data, regionObject, topResult):
 
-    # get data from individual town
+    # new attraction from extracted data (crawler extracts data in other processes, this part needs the main one)
+
+    newAttr = dict(data, link = attractionUrl, region = regionObject, topResult = topResult)
+
+    return newAttr
+
+
+
+def townGetData(townUrl, n, numLinks, context):
+
+    # get data from individual town, returns False if it failed
 
     try:
-        page = requests.get(townUrl)
-        tree = html.fromstring(page.content)
-        elTree = etree.HTML(page.text)
-
-        # name of the town:
-        townName = tree.xpath('// *[ @ id = "tdMainCenter"] / div[3] / div[1] / div[4] / h1/text()')
-        if len(townName) == 0:
-            townName = ['']
-
-        print(townName[0], '(', n, '/', numLinks, ')')
-        #print('link:', townUrl)
-
-        # web page of the town (from the first information centre info)
-        townWebPage = tree.xpath('//div[@class="ticItems"]/div[@class="item"]/div[@class="w"]/a/@href')
-        if len(townWebPage) == 0:
-            townWebPage = ['']
-        #print('spletna stran:', townWebPage[0])
-
-        # "mainTownData box with info"
-        # population:
-        townPop = tree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[@class="mainTownData"]/div[@class="item pop"]/div/text()')
-        if len(townPop) == 0:
-            townPop = -1
-        else:
-            townPop = int(townPop[0])
-        #print("population:", townPop)
-
-        # altitude:
-        townAlt = tree.xpath(
-            '//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[@class="mainTownData"]/div[@class="item alt"]/div/text()')
-        if len(townAlt) == 0:
-            townAlt = ['']
-        #print("altitude:", townAlt)
-
-        # position (more than one is possible, gotta join it):
-        townPos = tree.xpath(
-            '//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[@class="mainTownData"]/div[@class="item pos"]/text()')
-        if len(townPos) == 0:
-            townPos = ['']
-        else:
-            townPos = [','.join(townPos)]
-        #print("position:", townPos)
-
-        # temperatures (summer avg, winter avg):
-        townTemp = tree.xpath(
-            '//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[@class="mainTownData"]/div[@class="item tmpr"]//span[@class="N3"]/text()')
-        if len(townTemp) == 0:
-            townTemp = ['', '']
-        #print("summer temp:", townTemp)
-
-        # number of sunny / rainy days per year:
-        townSunnyDays = tree.xpath(
-            '//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/div[1]/div[@class="mainTownData"]/div[@class="item sun"]//span[@class="N3"]/text()')
-        if len(townSunnyDays) == 0:
-            townSunnyDays = ['-1', '-1']
-        #print("number of sunny/rainy days:", townSunnyDays)
-
-        # webpage path to town, we remove the first one as its always "Domov" and save the one before last as it tells as type of town
-        townNavPath = tree.xpath('//*[@id="tdMainCenter"]/div[1]//a/text()')
-        townType = townNavPath[len(townNavPath)-2]
-        townNavPath.pop(0)
-        townNavPath = ','.join(townNavPath)
-        #print("navigation path:", townNavPath)
-
-        # description:
-        townDescription = elTree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]')
-        #print("raw:,", etree.tostring(townDescription[0]))
-
-        # we remove unecessary parts (we only need body text)
-        childDiv = townDescription[0].find('div')
-        #print('Odstranjujem:', etree.tostring(childDiv))
-        if childDiv is not None:
-            townDescription[0].remove(childDiv)
-
-        # if we try to remove picture link, we also remove text -> NOT OK! TO-DO: http://stackoverflow.com/questions/22967659/removing-an-element-but-not-the-text-after-it
-        # childLink = townDescription[0].find('a')
-        # print('Removing:', etree.tostring(childLink))
-        # townDescription[0].remove(childLink)
-
-        # find all relative links in description and replace them with absolute ones
-        townDescriptionFixed = fixLinks(townDescription[0])
-
-        content = etree.tostring(townDescriptionFixed)
-        #print("description:", content)
-
-        # main picture: (we have to merge it with base url for full picture url)
-        townPictureMain = tree.xpath('//*[@id="tdMainCenter"]/div[3]/div[2]/div[1]/a/img/@src')
-        if len(townPictureMain) > 0 and not 'www' in townPictureMain[0]:
-            townPictureMain = baseUrlPictures + townPictureMain[0]
-        #print("link to main picture:", townPictureMain)
-
-        # region
-        townRegion = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row region"]/a/text()')
-        if len(townRegion) < 1:
-            townRegion = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row region"]/text()')
-            if len(townRegion) == 0:
-                townRegion = ['']
-        #print("region:", townRegion)
-
-        # destination
-        townDestination = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row destination"]/a/text()')
-        if len(townDestination) < 1:
-            townDestination = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row destination"]/text()')
-            if len(townDestination) == 0:
-                townDestination = ['']
-        #print("destination:", townDestination)
-
-        # place
-        townPlace = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row place"]/a/text()')
-        if len(townPlace) < 1:
-            townPlace = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row place"]/text()')
-            if len(townPlace) == 0:
-                townPlace = ['']
-        #print("place:", townPlace)
-
-        # GPS coordinates
-        townGPS = tree.xpath('//*[@id="wpMapSmall"]/div[2]/div[@class="row gps"]/a/text()')
-        if len(townGPS):
-            gpsX = float(townGPS[0].replace(',', '.'))
-            gpsY = float(townGPS[1].replace(',', '.'))
-        else:
-            gpsX = -1
-            gpsY = -1
-
-        #print("gps [x, y]:", townGPS)
-
-        # getting region from DB for foreign key (TO-DO: optimize this?)
-        region = getRegion(townRegion[0])
-
-        # check if it's top result with array we saved in the beginning (by comparing the part of urls, after the last '/' - we cannot compare full urls, they are different)
-        isTopResult = False
-        for link in topResults:
-            linkID = link.split('/')[-1]
-            townUrlID = townUrl.split('/')[-1]
-            if linkID == townUrlID:
-                isTopResult = True
-                break
-
-        #print('Top result:', isTopResult)
-        #print('------------------------------------------\n')
-
-
-        # saving to DB
-        if Town.select().where(Town.name == townName[0], Town.regionName == townRegion[0]).exists():
-            newTown = Town(name = townName[0],
-                             link = townUrl,
-                             webpage = townWebPage[0],
-                             population = townPop,
-                             altitude = townAlt[0],
-                             position = townPos[0],
-                             tempSummer = townTemp[0],
-                             tempWinter = townTemp[1],
-                             sunnyDays = int(townSunnyDays[0]),
-                             rainyDays = int(townSunnyDays[0]),
-                             tags = townNavPath,
-                             type = townType,
-                             description = content,
-                             picture = townPictureMain,
-                             regionName = townRegion[0],
-                             region = region,
-                             destination = townDestination[0],
-                             place = townPlace[0],
-                             gpsX = gpsX,
-                             gpsY = gpsY,
-                             topResult = isTopResult
-                             )
-
-            newTown.save()
+        # conditional request, skip the page if it didn't change since the last crawl
+        isTop = context.isTopResult(townUrl)
+        page = getPage(townUrl, headers=recrawl.conditionalHeaders(townUrl, isTop))
+        if recrawl.isUnchanged(townUrl, page, isTop):
+            print('Unchanged:', townUrl, '(', n, '/', numLinks, ')')
+            return True
+
+        newTown = townParseData(townUrl, page, isTop)
+        print(newTown['name'], '(', n, '/', numLinks, ')')
+
+        # saving to DB (in batches)
+        store.towns.add(newTown)
+        recrawl.remember(townUrl, page, isTop)
 
     except Exception as e:
         print('EXCEPTION:', str(e))
-        townLog.write("ERROR: " + townUrl + ' : ' + str(e) + '\n')
+        context.logError('town', townUrl, e)
+        return False
 
-    return
+    return True
 
 
 
-def fixLinks(content):
+def townParseData(townUrl, page, topResult):
 
-    # find all links and picture links in description and change them from relative to absolute
-    # solution from here: http://stackoverflow.com/questions/26167690/lxml-how-to-change-img-src-to-absolute-link
+    # parse town page, returns new town (row for DB)
 
-    for node in content.xpath('//*[@src]'):
-        url = node.get('src')
-        url = join(url)
-        node.set('src', url)
+    with metrics.timer('parse_seconds', kind='town'):
+        data = townExtract(page.content)
 
-    for node in content.xpath('//*[@href]'):
-        href = node.get('href')
-        url = join(href)
-        node.set('href', url)
+    return townRow(townUrl, data, topResult)
 
-    return content
 
 
+def townRow(townUrl, data, topResult):
 
-def join(url):
+    # new town from extracted data
 
-    # join relative URL with base URL
+    # region for foreign key, from the map of regions we load only once
+    region = store.regionId(data['regionName'])
 
-    if url.startswith("/") and not ("://" in url):
-        # if it starts with /
-        #print('Fixing:', (baseUrl+url))
-        return baseUrl + url
-    elif not ("://" in url or url.startswith("www")):
-        # if it doesn't start with /
-        #print('Fixing:', (baseUrlPictures + url))
-        return baseUrlPictures + url
-    elif url.startswith("www"):
-        return 'http://' + url
-    else:
-        # already absolute
-        return url
+    newTown = dict(data, link = townUrl, region = region, topResult = topResult)
 
+    return newTown
 
 
 
-# starting
-#prepareLogFiles()
-db = connectDB()
-db.connect()
-#initDB(db)
+# starting (DB connection is opened on the first query)
+#context = prepareLogFiles()
+#initDB(connectDB())
 
 # start with all regions, then  add towns
-#selectRegion()
-#addTowns()
-
-db.close()
\ No newline at end of file
+#selectRegion(context)
+#addTowns(context)
\ No newline at end of file
@@ -0,0 +1,134 @@
+import collections
+import sys
+import numpy
+from peewee import IntegerField, DoubleField, BooleanField, DateTimeField, ForeignKeyField, PrimaryKeyField
+from models import Region, Attraction, Town
+
+
+# columnar snapshot of regions, attractions and towns (everything search.init() needs), so the index can be built
+# without DB (in CI, on web nodes): search.init(snapshot='snapshot.npz')
+# one compressed .npz file, every column is an array: numbers, booleans and dates as numpy arrays, strings as a
+# string table (all values of a column as UTF-8 in one byte array + offsets of values); HTML of descriptions is left out
+# run: python snapshot.py [snapshot.npz]
+
+fileName = 'snapshot.npz'
+models = [Region, Attraction, Town]
+
+
+
+def fields(model):
+
+    # fields that go to snapshot (same as in search.indexQuery())
+
+    return [field for field in model._meta.sorted_fields if field.name != 'descriptionHtml']
+
+
+
+def columnType(field):
+
+    # numpy type of a column, None = string
+
+    if isinstance(field, (IntegerField, PrimaryKeyField, ForeignKeyField)):
+        return numpy.int64
+    if isinstance(field, DoubleField):
+        return numpy.float64
+    if isinstance(field, BooleanField):
+        return numpy.bool_
+    if isinstance(field, DateTimeField):
+        return 'datetime64[us]'
+
+    return None
+
+
+
+def stringTable(values):
+
+    # list of strings -> (UTF-8 bytes of all of them, offsets: value i is data[offsets[i]:offsets[i + 1]])
+
+    encoded = [('' if value is None else str(value)).encode('utf-8') for value in values]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(value) for value in encoded])
+    blob = b''.join(encoded)
+
+    return numpy.frombuffer(blob, dtype=numpy.uint8) if blob else numpy.zeros(0, dtype=numpy.uint8), offsets
+
+
+
+def strings(data, offsets):
+
+    # string table -> list of strings
+
+    blob = data.tobytes()
+
+    return [blob[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+
+def export(path=fileName):
+
+    # write all three tables from DB to path
+
+    arrays = {}
+    for model in models:
+        table = model._meta.db_table
+        modelFields = fields(model)
+        rows = list(model.select(*modelFields).tuples())
+        columns = list(zip(*rows)) if len(rows) > 0 else [[] for field in modelFields]
+
+        arrays[table + '.columns'] = numpy.array([field.name for field in modelFields])
+        for field, values in zip(modelFields, columns):
+            key = table + '.' + field.name
+            kind = columnType(field)
+            if kind is None:
+                arrays[key + '.data'], arrays[key + '.offsets'] = stringTable(values)
+            else:
+                arrays[key] = numpy.array(values, dtype=kind)
+
+        print('Snapshot:', table, len(rows), 'rows')
+
+    numpy.savez_compressed(path, **arrays)
+
+    return
+
+
+
+class Snapshot(object):
+
+    # snapshot read from a file; rows(model) gives rows with the same attributes as model instances
+
+    def __init__(self, path=fileName):
+        self.data = numpy.load(path)
+
+
+    def columns(self, model):
+
+        # column name -> list of values
+
+        table = model._meta.db_table
+        names = self.data[table + '.columns'].tolist()
+        columns = collections.OrderedDict()
+        for name in names:
+            key = table + '.' + name
+            if key + '.offsets' in self.data.files:
+                columns[name] = strings(self.data[key + '.data'], self.data[key + '.offsets'])
+            else:
+                columns[name] = self.data[key].tolist()
+
+        return columns
+
+
+    def rows(self, model):
+        columns = self.columns(model)
+        row = collections.namedtuple(model.__name__ + 'Row', list(columns.keys()))
+
+        return [row(*values) for values in zip(*columns.values())]
+
+
+
+def load(path=fileName):
+    return Snapshot(path)
+
+
+
+if __name__ == '__main__':
+    export(sys.argv[1] if len(sys.argv) > 1 else fileName)
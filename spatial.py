@@ -0,0 +1,217 @@
+import os
+import numpy
+
+
+# in-memory spatial index of items with GPS coordinates (attractions and towns), for "v bližini" queries
+# search.init() builds it together with the Whoosh index and saves it next to it (index/spatial.npz); items without
+# coordinates (-1) are left out
+# points are sorted by cells of a grid (cellKm wide), nearby() and nearest() only look at cells that can have a hit,
+# so a query costs microseconds; distances are in km (equirectangular approximation, good enough for Slovenia)
+# gpsX is latitude, gpsY longitude
+
+fileName = 'spatial.npz'
+earthRadius = 6371.0                # km
+kmPerDegree = 111.195               # km per degree of latitude
+
+loaded = {}                         # index dir -> (version of index, SpatialIndex), only the latest one
+
+
+
+def distances(lat, lon, lats, lons):
+
+    # km from (lat, lon) to every point
+
+    x = numpy.radians(lons - lon) * numpy.cos(numpy.radians((lats + lat) / 2))
+    y = numpy.radians(lats - lat)
+
+    return earthRadius * numpy.sqrt(x * x + y * y)
+
+
+
+class SpatialIndex(object):
+
+    # types, ids, names = typeID, id and lowercase name of every item; lat, lon = its gpsX, gpsY
+
+    def __init__(self, types, ids, names, lat, lon, cellKm=2.0):
+        types = numpy.asarray(types, dtype=str)
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        names = numpy.asarray(names, dtype=str)
+        lat = numpy.asarray(lat, dtype=numpy.float64)
+        lon = numpy.asarray(lon, dtype=numpy.float64)
+
+        # no coordinates: -1 (or nothing at all)
+        keep = (lat != -1) & (lon != -1) & numpy.isfinite(lat) & numpy.isfinite(lon)
+
+        # cell size in degrees, longitude degrees are shorter in the north
+        self.cellKm = cellKm
+        self.cellLat = cellKm / kmPerDegree
+        middle = lat[keep].mean() if keep.any() else 46.0
+        self.cellLon = cellKm / (kmPerDegree * numpy.cos(numpy.radians(middle)))
+
+        rows = numpy.floor(lat[keep] / self.cellLat).astype(numpy.int64)
+        cols = numpy.floor(lon[keep] / self.cellLon).astype(numpy.int64)
+        cells = rows * 100000 + cols
+        order = numpy.argsort(cells, kind='mergesort')
+
+        self.types = types[keep][order]
+        self.ids = ids[keep][order]
+        self.names = names[keep][order]
+        self.lat = lat[keep][order]
+        self.lon = lon[keep][order]
+        self.docnums = numpy.full(len(self.ids), -1, dtype=numpy.int64)      # filled by attach()
+
+        # cell -> (first, last + 1) position of its points
+        cells = cells[order]
+        keys, starts = numpy.unique(cells, return_index=True)
+        ends = numpy.append(starts[1:], len(cells))
+        self.cells = dict(zip(keys.tolist(), zip(starts.tolist(), ends.tolist())))
+
+        # town name -> position (for locationAssistant)
+        self.towns = {}
+        for i in numpy.flatnonzero(self.types == 'town'):
+            self.towns.setdefault(self.names[i], (self.lat[i], self.lon[i]))
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def save(self, path):
+        numpy.savez(path, types=self.types, ids=self.ids, names=self.names, lat=self.lat, lon=self.lon,
+                    cellKm=self.cellKm)
+
+
+    @classmethod
+    def load(cls, path):
+        data = numpy.load(path)
+
+        return cls(data['types'], data['ids'], data['names'], data['lat'], data['lon'], float(data['cellKm']))
+
+
+    def candidates(self, lat, lon, km):
+
+        # positions of points in cells that touch the square around (lat, lon)
+
+        rowFrom = int(numpy.floor((lat - km / kmPerDegree) / self.cellLat))
+        rowTo = int(numpy.floor((lat + km / kmPerDegree) / self.cellLat))
+        lonKm = kmPerDegree * numpy.cos(numpy.radians(lat))
+        colFrom = int(numpy.floor((lon - km / lonKm) / self.cellLon))
+        colTo = int(numpy.floor((lon + km / lonKm) / self.cellLon))
+
+        ranges = []
+        if (rowTo - rowFrom + 1) * (colTo - colFrom + 1) > len(self.cells):
+            # bigger than the whole grid, just take all cells
+            ranges = list(self.cells.values())
+        else:
+            for row in range(rowFrom, rowTo + 1):
+                for col in range(colFrom, colTo + 1):
+                    cell = self.cells.get(row * 100000 + col)
+                    if cell is not None:
+                        ranges.append(cell)
+
+        if len(ranges) == 0:
+            return numpy.empty(0, dtype=numpy.int64)
+
+        return numpy.concatenate([numpy.arange(start, end) for start, end in ranges])
+
+
+    def nearby(self, lat, lon, km):
+
+        # (positions, distances) of all points within km, closest first
+
+        positions = self.candidates(lat, lon, km)
+        found = distances(lat, lon, self.lat[positions], self.lon[positions])
+        inside = found <= km
+        positions = positions[inside]
+        found = found[inside]
+        order = numpy.argsort(found, kind='mergesort')
+
+        return positions[order], found[order]
+
+
+    def nearest(self, lat, lon, k, maxKm=None):
+
+        # (positions, distances) of k closest points (not farther than maxKm), closest first
+        # search area grows until it has k points; points found within its radius are surely the closest ones
+
+        km = self.cellKm
+        while True:
+            limit = km if maxKm is None else min(km, maxKm)
+            positions, found = self.nearby(lat, lon, limit)
+            if len(positions) >= k or limit == maxKm or len(positions) == len(self):
+                return positions[:k], found[:k]
+            km *= 2
+
+
+    def attach(self, searcher):
+
+        # docnums of items in a given Whoosh index (by typeID and id), -1 for items that are not there
+
+        positions = {(self.types[i], int(self.ids[i])): i for i in range(len(self))}
+        self.byDoc = numpy.full(searcher.doc_count_all(), -1, dtype=numpy.int64)      # docnum -> position
+        for docnum, fields in searcher.reader().iter_docs():
+            i = positions.get((fields.get('typeID'), int(fields.get('id') or -1)))
+            if i is not None:
+                self.docnums[i] = docnum
+                self.byDoc[docnum] = i
+
+        return self
+
+
+    def coordinates(self, docnums):
+
+        # (lat, lon) arrays of items with given Whoosh docnums (array), NaN for items without coordinates
+
+        positions = self.byDoc[docnums]
+        known = positions >= 0
+        lat = numpy.full(len(docnums), numpy.nan)
+        lon = numpy.full(len(docnums), numpy.nan)
+        lat[known] = self.lat[positions[known]]
+        lon[known] = self.lon[positions[known]]
+
+        return lat, lon
+
+
+    def nearbyDocs(self, lat, lon, km):
+
+        # set of Whoosh docnums within km (for filter of searcher.search())
+
+        positions, found = self.nearby(lat, lon, km)
+        docnums = self.docnums[positions]
+
+        return set(docnums[docnums >= 0].tolist())
+
+
+    def position(self, location):
+
+        # (lat, lon) of user; location is (gpsX, gpsY) or name of a town, None if we don't know it
+
+        if isinstance(location, (tuple, list)) and len(location) == 2:
+            return float(location[0]), float(location[1])
+        if isinstance(location, str):
+            return self.towns.get(location.lower())
+
+        return None
+
+
+
+def forIndex(index):
+
+    # spatial index of a given Whoosh index (loaded once per index version), None if there is none
+    # an index that was built again replaces the old one, so a web app doesn't keep every version in memory
+
+    # (index built again from scratch can have the same generation, so time of spatial.npz is part of the version)
+
+    folder = index.storage.folder
+    path = os.path.join(folder, fileName)
+    if not os.path.exists(path):
+        loaded.pop(folder, None)
+        return None
+
+    version = (index.latest_generation(), os.stat(path).st_mtime_ns)
+    cached = loaded.get(folder)
+    if cached is None or cached[0] != version:
+        with index.searcher() as searcher:
+            loaded[folder] = (version, SpatialIndex.load(path).attach(searcher))
+
+    return loaded[folder][1]
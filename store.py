@@ -0,0 +1,231 @@
+from collections import OrderedDict
+from models import *
+import metrics
+
+
+# writing scraped rows to DB
+# rows (dicts with the same keys as model fields) are buffered and written in batches, one multi-row
+# 'INSERT ... ON CONFLICT DO UPDATE' per batch, inside a transaction; items already in DB get updated
+# (conflicts are checked on the unique indexes from models.py: Region.name, (name, regionName) for the others; a DB
+# created before they were added needs "python migrations.py", writes stop with an error until then)
+# region foreign keys are resolved from a map (region name -> id) that is loaded from DB only once
+# when one buffer is full, all of them get flushed (in order), so rows that depend on other rows (state of a page,
+# crawl frontier) never get to DB before them; rows that can't be written are passed to failedHooks of their buffer
+# (before the later buffers are flushed), so rows that depend on them can be changed or dropped
+
+batchSize = 100
+
+regionIds = None
+
+# all buffers, in the order they get flushed
+buffers = []
+
+# (table, conflict columns) that have a unique index in DB (checked once)
+checkedUnique = set()
+
+
+
+class RowBuffer(object):
+
+    # buffer for rows of one model; 'conflict' = fields of the unique index we upsert on, with update=False rows
+    # that are already in DB are left as they are
+
+    def __init__(self, model, conflict, size=batchSize, update=True):
+        self.model = model
+        self.conflict = conflict
+        self.update = update
+        self.size = size
+        self.rows = OrderedDict()
+        self.written = 0
+        self.errors = 0
+        self.failedHooks = []       # functions(model, row), called for every row that couldn't be written
+        buffers.append(self)
+
+
+    def add(self, row):
+
+        # the same item can show up more than once in a batch, the last one wins
+        # (postgres doesn't allow updating the same row twice in one statement)
+
+        key = tuple(row[field] for field in self.conflict)
+        self.rows[key] = row
+
+        if len(self.rows) >= self.size:
+            flushAll()
+
+        return
+
+
+    def flush(self):
+
+        # write all buffered rows in one transaction; if that fails, write them one by one, so one bad row
+        # doesn't cost us the whole batch
+
+        if len(self.rows) == 0:
+            return 0
+
+        checkUnique(self.model, self.conflict)
+
+        rows = list(self.rows.values())
+        self.rows = OrderedDict()
+
+        database = self.model._meta.database
+        name = self.model.__name__
+        try:
+            with metrics.timer('db_write_seconds', model=name), database.atomic():
+                upsert(self.model, rows, self.conflict, update=self.update)
+            self.written += len(rows)
+            metrics.count('db_rows_total', len(rows), model=name)
+
+        except Exception as e:
+            print('ERROR: batch of', len(rows), self.model.__name__, 'rows failed, writing one by one:', e)
+            for row in rows:
+                try:
+                    with metrics.timer('db_write_seconds', model=name), database.atomic():
+                        upsert(self.model, [row], self.conflict, update=self.update)
+                    self.written += 1
+                    metrics.count('db_rows_total', model=name)
+
+                except Exception as e:
+                    print('ERROR:', self.model.__name__, row.get('link'), ':', e)
+                    self.errors += 1
+                    metrics.count('errors_total', stage='store', kind=name)
+                    for hook in self.failedHooks:
+                        hook(self.model, row)
+
+        print('Saved', len(rows), self.model.__name__, 'rows (all together:', self.written, ')')
+
+        return len(rows)
+
+
+
+def checkUnique(model, conflict):
+
+    # upserts need a unique index on the conflict fields; a DB created with an older models.py doesn't have them
+    # (without this check, every batch and then every single row would fail)
+
+    table = model._meta.db_table
+    columns = frozenset(model._meta.fields[name].db_column for name in conflict)
+    if (table, columns) in checkedUnique:
+        return
+
+    database = model._meta.database
+    if not any(index.unique and frozenset(index.columns) == columns for index in database.get_indexes(table)):
+        raise RuntimeError('Table %s has no unique index on (%s), run "python migrations.py" first'
+                           % (table, ', '.join(sorted(columns))))
+
+    checkedUnique.add((table, columns))
+
+    return
+
+
+
+def checkAll():
+
+    # check unique indexes of all buffers (and regions) before a crawl starts, so a DB that needs migrations stops
+    # it right away (and not in the middle, from whatever row fills a buffer)
+
+    checkUnique(Region, ['name'])
+    for buffer in buffers:
+        # page and frontier tables are created when they are first needed
+        buffer.model.create_table(fail_silently=True)
+        checkUnique(buffer.model, buffer.conflict)
+
+    return
+
+
+
+def upsert(model, rows, conflict, returning=None, update=True):
+
+    # multi-row insert; rows that are already in DB (same values in 'conflict' fields) get updated instead (or
+    # skipped, with update=False)
+    # peewee 2.8 can't do 'ON CONFLICT' for postgres, so we add it to the SQL of a regular insert_many
+
+    database = model._meta.database
+    compiler = database.compiler()
+    fields = model._meta.fields
+
+    sql, params = model.insert_many(rows).sql()
+    conflictColumns = [compiler.quote(fields[name].db_column) for name in conflict]
+
+    if not update:
+        sql += ' ON CONFLICT (%s) DO NOTHING' % ', '.join(conflictColumns)
+        return database.execute_sql(sql, params)
+
+    # everything but the key gets updated, including timestamp (filled in by its default)
+    updateFields = [name for name in rows[0] if name not in conflict and name != 'id']
+    if 'timestamp' in fields and 'timestamp' not in updateFields:
+        updateFields.append('timestamp')
+
+    updateColumns = [compiler.quote(fields[name].db_column) for name in updateFields]
+
+    sql += ' ON CONFLICT (%s) DO UPDATE SET %s' % (
+        ', '.join(conflictColumns),
+        ', '.join('%s = EXCLUDED.%s' % (column, column) for column in updateColumns))
+
+    if returning:
+        sql += ' RETURNING ' + ', '.join(compiler.quote(fields[name].db_column) for name in returning)
+
+    return database.execute_sql(sql, params)
+
+
+
+def loadRegions():
+    global regionIds
+
+    # map of region names to their ids, loaded once
+
+    if regionIds is None:
+        regionIds = {region.name: region.id for region in Region.select(Region.id, Region.name)}
+
+    return regionIds
+
+
+
+def saveRegion(row):
+
+    # regions are written right away (there are only a few), because attractions need their id; returns the id
+
+    checkUnique(Region, ['name'])
+
+    database = Region._meta.database
+    with metrics.timer('db_write_seconds', model='Region'), database.atomic():
+        cursor = upsert(Region, [row], ['name'], returning=['id'])
+        newId = cursor.fetchone()[0]
+    metrics.count('db_rows_total', model='Region')
+
+    loadRegions()[row['name']] = newId
+
+    return newId
+
+
+
+def regionId(name):
+
+    # id of region with given name (None if there is no such region); regions saved by other workers after the map
+    # was loaded are looked up in DB
+
+    regions = loadRegions()
+    if name not in regions:
+        region = Region.select(Region.id).where(Region.name == name).first()
+        if region is None:
+            return None
+        regions[name] = region.id
+
+    return regions[name]
+
+
+
+def flushAll():
+
+    # write everything that is still in buffers (items first, other buffers are created later and may depend on them)
+
+    for buffer in buffers:
+        buffer.flush()
+
+    return
+
+
+
+attractions = RowBuffer(Attraction, ['name', 'regionName'])
+towns = RowBuffer(Town, ['name', 'regionName'])
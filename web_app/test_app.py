@@ -5,14 +5,41 @@ from flask import Flask, render_template, request, make_response, jsonify
 from flask_restful import Resource, Api
 from flask_httpauth import HTTPBasicAuth
 from search import analyzeQuery
-from slovenia_info_scra import getFromDB
+from slovenia_info_scra import getFromDB, getManyFromDB
+from models import connectDB
 from whoosh.index import open_dir
+import searchbackend
 import json
 
 
 app = Flask(__name__)
 
 
+# every request takes a DB connection from the pool and gives it back when it's done
+
+database = connectDB()
+
+@app.before_request
+def openDB():
+    if database.is_closed():
+        database.connect()
+
+@app.teardown_request
+def closeDB(exception):
+    if not database.deferred and not database.is_closed():
+        database.close()
+
+
+# search backend: Whoosh index in "../index" or full-text search in PostgreSQL (run "python searchbackend.py" once)
+
+usePostgres = False
+
+def openIndex():
+    if usePostgres:
+        return searchbackend.PostgresBackend(database)
+    return open_dir("../index")
+
+
 # some basic http auth
 
 auth = HTTPBasicAuth()
@@ -41,8 +68,7 @@ def search():
         text = request.form['input']
 
         # perform a search, calling def from search.py
-        # set a path to correct 'index' dir
-        index = open_dir("../index")
+        index = openIndex()
         dict = analyzeQuery(index, text)
 
     return render_template('results.html', results=dict)
@@ -67,8 +93,7 @@ class QueryAPI(Resource):
     def get(self, query):
 
         # perform a search, calling def from search.py
-        # set a path to correct 'index' dir
-        index = open_dir("../index")
+        index = openIndex()
         dict = analyzeQuery(index, query)
         result = json.dumps(dict, ensure_ascii=False, indent=4, sort_keys=True, separators=(',', ': '))
         print(result)
@@ -96,8 +121,40 @@ class ItemAPI(Resource):
         return resJson
 
 
+class ItemsAPI(Resource):
+
+    # more items in one call (one DB query per type), returned in the same order; missing items are null
+    # GET /items?items=attraction/25,town/3 or POST /items with JSON [["attraction", 25], ["town", 3]]
+
+    maxItems = 100
+
+    def items(self):
+        try:
+            if request.method == 'POST':
+                items = [(str(type), int(id)) for type, id in request.get_json(force=True)]
+            else:
+                items = [(pair.split('/')[0], int(pair.split('/')[1])) for pair in request.args['items'].split(',')]
+        except Exception:
+            return None
+
+        return items if 0 < len(items) <= self.maxItems else None
+
+    @auth.login_required
+    def get(self):
+        items = self.items()
+        if items == None:
+            return {'ERROR': 'Expected a list of up to %d items: type/id,type/id,...' % self.maxItems}, 400
+
+        return getManyFromDB(items)
+
+    @auth.login_required
+    def post(self):
+        return self.get()
+
+
 api.add_resource(QueryAPI, '/query/<string:query>', endpoint='query')
 api.add_resource(ItemAPI, '/item/<string:type>/<int:id>', endpoint='item')
+api.add_resource(ItemsAPI, '/items', endpoint='items')
 
 
 
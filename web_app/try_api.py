@@ -17,6 +17,20 @@ def testItem(type, id):
     return
 
 
+def testItems(items):
+    # get more items form DB in one call, items = list of (type, id)
+
+    fullUrl = baseAPIUrl + 'items'
+    response = requests.post(fullUrl, json=items, auth=('asistent', 'projektasistent'))
+    print(response)
+    data = response.json()
+    for item in data:
+        print(item['name'] if item else None)
+    print('---------------------------------------------------------------------------\n')
+
+    return
+
+
 def testQuery(query):
     # get results for given query
 
@@ -38,5 +52,6 @@ def testQuery(query):
 
 
 #testItem('attraction', 50)
+#testItems([('attraction', 50), ('town', 3), ('region', 1)])
 testQuery('ljubljanski grad')
 #testQuery('seznam rek v ljubljani')
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import socket
+import time
+from models import *
+import crawler
+import frontier
+import store
+
+
+# crawl with more workers (processes on one or more machines) that share the frontier table in postgres
+# one of them seeds the frontier (seed()), then every worker leases batches of pending entries (frontier.claim()),
+# crawls them with the crawler.py engine and writes rows to the same tables; pages found on the way are added to
+# the shared frontier, so any worker can take them
+# while a worker is alive it sends heartbeats (table 'crawlworker') that also extend its leases; entries of a worker
+# without heartbeats go back to pending after their lease expires
+# 'rate' is the limit for all workers together: every worker uses rate / number of live workers
+# towns are crawled after everything else is done (they need regions in DB)
+
+
+
+def seed(regionUrls, townsUrl=None):
+
+    # start a new shared crawl (do this once, before starting workers)
+
+    frontier.clear()
+    CrawlWorker.create_table(fail_silently=True)
+    for url in regionUrls:
+        frontier.add(frontier.entry(url, 'region'))
+    if townsUrl:
+        frontier.add(frontier.entry(townsUrl, 'towns'))
+    store.flushAll()
+
+    return
+
+
+
+def workerSqlNames():
+
+    # quoted table and column names of CrawlWorker (name, heartbeat)
+
+    compiler = CrawlWorker._meta.database.compiler()
+
+    return (compiler.quote(CrawlWorker._meta.db_table), compiler.quote(CrawlWorker.name.db_column),
+            compiler.quote(CrawlWorker.heartbeat.db_column))
+
+
+
+class Worker(crawler.Crawler):
+
+    # name = unique name of worker (default: host and process id), batch = entries leased at once,
+    # leaseSeconds = how long a lease is valid without heartbeats, heartbeat = seconds between heartbeats,
+    # idle = seconds to wait when there is nothing to lease but other workers are still crawling
+    # other options are the same as for crawler.Crawler ('rate' is the limit for all workers together)
+
+    def __init__(self, name=None, batch=20, leaseSeconds=120, heartbeat=15, idle=5, **options):
+        crawler.Crawler.__init__(self, **options)
+        self.name = name or '%s-%d' % (socket.gethostname(), os.getpid())
+        self.batch = batch
+        self.leaseSeconds = leaseSeconds
+        self.heartbeatSeconds = heartbeat
+        self.idle = idle
+        self.globalRate = self.rate
+        self.globalBurst = self.burst
+
+
+    def add(self, newEntry):
+
+        # page found: it only goes to the shared frontier, some worker will lease it
+
+        if not frontier.add(newEntry):
+            self.duplicates += 1
+
+        return
+
+
+    def liveWorkers(self):
+
+        # number of workers with a recent heartbeat (at least this one); times are from DB, workers on other
+        # machines have other clocks
+
+        table, name, heartbeat = workerSqlNames()
+        sql = 'SELECT count(*) FROM %s WHERE %s > now() - %%s * interval \'1 second\'' % (table, heartbeat)
+        count = CrawlWorker._meta.database.execute_sql(sql, [3 * self.heartbeatSeconds]).fetchone()[0]
+
+        return max(1, count)
+
+
+    def beat(self):
+
+        # heartbeat: we're alive, keep our leases and adjust our share of the rate limit
+
+        table, name, heartbeat = workerSqlNames()
+        sql = 'INSERT INTO %s (%s, %s) VALUES (%%s, now()) ON CONFLICT (%s) DO UPDATE SET %s = now()' % (
+            table, name, heartbeat, name, heartbeat)
+        CrawlWorker._meta.database.execute_sql(sql, [self.name])
+        frontier.extendLeases(self.name, self.leaseSeconds)
+
+        workers = self.liveWorkers()
+        self.rate = self.globalRate / workers
+        self.burst = max(1, self.globalBurst // workers)
+        for bucket in self.buckets.values():
+            bucket.rate = self.rate
+            bucket.burst = self.burst
+
+        return workers
+
+
+    async def heartbeats(self):
+
+        while True:
+            await asyncio.sleep(self.heartbeatSeconds)
+            self.beat()
+
+
+    def lease(self):
+
+        # next batch of entries; towns only when nobody is crawling anything else any more
+
+        frontier.requeueExpired()
+        entries = frontier.claim(self.name, self.batch, self.leaseSeconds)
+        if len(entries) == 0 and frontier.remaining(towns=False) == 0:
+            entries = frontier.claim(self.name, self.batch, self.leaseSeconds, towns=True)
+
+        return entries
+
+
+    async def crawlShared(self):
+
+        # lease and crawl batches until the whole frontier is crawled
+
+        workers = self.startWorkers()
+        workers.append(self.loop.create_task(self.heartbeats()))
+
+        try:
+            while True:
+                entries = self.lease()
+                if len(entries) == 0:
+                    if frontier.remaining() == 0:
+                        break
+                    # others are still working, they may find new pages (or die, then we get their entries)
+                    await asyncio.sleep(self.idle)
+                    continue
+
+                for entry in entries:
+                    self.queue.put_nowait(entry)
+                await self.drain()
+
+                # results and new entries go to DB, so other workers see them
+                store.flushAll()
+                print(self.name, ': crawled', len(entries), 'entries,', self.pages, 'pages all together')
+        finally:
+            await self.stopWorkers(workers)
+
+        return
+
+
+    def run(self):
+
+        # work on the shared frontier until it's all crawled
+
+        CrawlWorker.create_table(fail_silently=True)
+        store.checkAll()
+        print('Worker', self.name, 'starting,', self.beat(), 'workers alive')
+
+        start = time.time()
+        try:
+            self.loop.run_until_complete(self.crawlShared())
+
+        except KeyboardInterrupt:
+            print('Worker stopped, its leases will expire')
+
+        finally:
+            store.flushAll()
+            CrawlWorker.delete().where(CrawlWorker.name == self.name).execute()
+
+        elapsed = time.time() - start
+
+        print('Worker', self.name, 'crawled', self.pages, 'pages in', round(elapsed, 1), 's,', self.unchanged, 'unchanged')
+        for stage in self.stages:
+            stage.report(elapsed)
+        self.executor.shutdown()
+        self.processes.shutdown()
+
+        return
+
+
+
+# starting: seed once, then run workers (as many processes, on as many machines, as you like)
+#import slovenia_info_scra as scra
+#seed([region + str(scra.lng) for region in scra.regions], scra.townsUrl + str(scra.lng))
+#Worker(context=scra.prepareLogFiles()).run()